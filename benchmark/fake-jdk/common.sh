@@ -0,0 +1,10 @@
+# Sourced by the fake JDK tools: count the run, add latency, fail now and then.
+# BENCH_DIR, BENCH_LATENCY (seconds) and BENCH_FAIL_PERMILLE are set by jvm-bench.py.
+printf x >> "$BENCH_DIR/tool-runs"
+if [ "${BENCH_LATENCY:-0}" != "0" ]; then
+    sleep "$BENCH_LATENCY"
+fi
+if [ $(( $$ % 1000 )) -lt "${BENCH_FAIL_PERMILLE:-0}" ]; then
+    echo "simulated failure" >&2
+    exit 1
+fi
@@ -0,0 +1,389 @@
+"""
+Benchmark of the collectors against a fleet of synthetic JVMs.
+
+Every synthetic JVM is a real, idle process (so /proc/<pid> exists) with
+-D/-Xmx options in its JAVA_TOOL_OPTIONS, a PerfData file under a private
+HSPERFDATA_TMPDIR and an entry in the list printed by the fake `jps`. The fake
+JDK tools in fake-jdk/ answer like the real ones after BENCH_LATENCY seconds
+and fail for about --failure-rate of the runs. A local HTTP server stands in
+for the Pushgateway, InfluxDB and service discovery.
+
+Each strategy runs in its own process, so its CPU time and peak RSS are its
+own. Per cycle the result holds:
+
+  wall_seconds       time for one collect-and-push cycle
+  cpu_seconds        user + system time of the collector itself
+  child_cpu_seconds  user + system time of the tools it ran and reaped (fake
+                     ones here, a real jstat/jinfo costs a JVM start on top;
+                     long-running jstat streams only count once they exit)
+  tool_runs          JDK tool executions
+  forks              processes created on the whole host (/proc/stat)
+  peak_rss_bytes     peak RSS of the collector so far
+
+Usage:
+  python benchmark/jvm-bench.py --jvms 1,100,2000 --latency 0.05 \\
+      --failure-rate 0.01 --output results.json
+"""
+import argparse
+import http.server
+import importlib.util
+import json
+import os
+import platform
+import resource
+import runpy
+import shutil
+import signal
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_JDK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake-jdk")
+
+_ALL_FIX = "jvm-pusher/jvm-pusher-all-fix.py"
+_LEGACY_TOOLS = {"GC_PROVIDER": "jstat", "DISCOVERY": "jps", "METADATA_SOURCE": "jinfo"}
+
+# name -> (script, extra environment, how one cycle is run)
+STRATEGIES = {
+    "jvm-parser":            ("jvm-parser.py", {}, "script"),
+    "jvm-metrics":           ("jvm-metrics/jvm-metrics.py", {}, "collect"),
+    "jvm-pusher":            ("jvm-pusher/jvm-pusher.py", {}, "push_metrics"),
+    "jvm-pusher-all":        ("jvm-pusher/jvm-pusher-all.py", {}, "push_metrics"),
+    "all-fix/hsperfdata":    (_ALL_FIX, {}, "push_metrics"),
+    "all-fix/jcmd":          (_ALL_FIX, {"GC_PROVIDER": "jcmd"}, "push_metrics"),
+    "all-fix/jstat-stream":  (_ALL_FIX, {"GC_PROVIDER": "jstat-stream"}, "push_metrics"),
+    "all-fix/jstat":         (_ALL_FIX, _LEGACY_TOOLS, "push_metrics"),
+    "all-fix/jstat-asyncio": (_ALL_FIX, dict(_LEGACY_TOOLS, RUNTIME="asyncio"), "asyncio"),
+    "all-fix/pid-mode":      (_ALL_FIX, {"PUSH_MODE": "pid"}, "push_metrics"),
+    "jvm-pusher-influxdb":   ("jvm-pusher-influxdb/jvm-pusher-influxdb.py", {}, "push_metrics"),
+}
+
+# -- synthetic PerfData files -------------------------------------------------
+
+_COUNTERS = [
+    ("sun.os.hrt.frequency", 1000000000),
+    ("sun.gc.policy.name", "GarbageFirst"),
+    ("sun.gc.generation.0.maxCapacity", 268435456),
+    ("sun.gc.generation.1.maxCapacity", 268435456),
+    ("sun.gc.generation.0.space.0.capacity", 113246208),
+    ("sun.gc.generation.0.space.0.used", 25165824),
+    ("sun.gc.generation.0.space.1.capacity", 0),
+    ("sun.gc.generation.0.space.1.used", 0),
+    ("sun.gc.generation.0.space.2.capacity", 4194304),
+    ("sun.gc.generation.0.space.2.used", 4194304),
+    ("sun.gc.generation.1.space.0.capacity", 150994944),
+    ("sun.gc.generation.1.space.0.used", 67108864),
+    ("sun.gc.metaspace.capacity", 41943040),
+    ("sun.gc.metaspace.used", 40265318),
+    ("sun.gc.compressedclassspace.capacity", 5242880),
+    ("sun.gc.compressedclassspace.used", 4823449),
+    ("sun.gc.collector.0.invocations", 12),
+    ("sun.gc.collector.0.time", 120000000),
+    ("sun.gc.collector.1.invocations", 1),
+    ("sun.gc.collector.1.time", 250000000),
+    ("sun.gc.collector.2.invocations", 4),
+    ("sun.gc.collector.2.time", 10000000),
+]
+
+
+def perfdata(counters, size=32 * 1024):
+    """A little-endian hsperfdata file with the given (name, long or str) counters."""
+    body = b""
+    for name, value in counters:
+        name = name.encode() + b"\0"
+        if isinstance(value, int):
+            data, data_type, vector_length = struct.pack("<q", value), ord("J"), 0
+            padding = -(20 + len(name)) % 8
+        else:
+            data = value.encode() + b"\0"
+            data_type, vector_length, padding = ord("B"), len(data), 0
+        data_offset = 20 + len(name) + padding
+        entry_length = data_offset + len(data)
+        entry_length += -entry_length % 8
+        entry = struct.pack("<iiiBBBBi", entry_length, 20, vector_length, data_type, 0, 1, 3, data_offset)
+        entry += name + b"\0" * padding + data
+        body += entry + b"\0" * (entry_length - len(entry))
+    prologue = struct.pack(">I", 0xCAFEC0C0) + b"\x01"
+    prologue += struct.pack("<BBBiiqii", 2, 0, 1, 32 + len(body), 0, 0, 32, len(counters))
+    data = prologue + body
+    return data + b"\0" * (size - len(data))
+
+
+class Fleet:
+    """`count` idle processes that look like JVMs to every discovery method."""
+
+    def __init__(self, workdir: str, count: int):
+        self.workdir = workdir
+        self.hsperfdata = os.path.join(workdir, "hsperfdata_bench")
+        os.makedirs(self.hsperfdata, exist_ok=True)
+        # All of them block reading one pipe; closing its write end ends them all
+        read_fd, self._write_fd = os.pipe()
+        self.procs = []
+        try:
+            for i in range(count):
+                options = f"-Dcom.netfolio.appname=bench-{i} -Dcom.netfolio.fullname=bench-{i}-variant -Xmx256m"
+                env = dict(os.environ, JAVA_TOOL_OPTIONS=options)
+                proc = subprocess.Popen(["cat"], stdin=read_fd, stdout=subprocess.DEVNULL, env=env)
+                self.procs.append(proc)
+        finally:
+            os.close(read_fd)
+        for proc in self.procs:
+            self._publish(proc.pid)
+        with open(os.path.join(workdir, "jvms"), "w") as f:
+            f.writelines(f"{proc.pid} Main\n" for proc in self.procs)
+
+    def _publish(self, pid: int):
+        counters = [
+            ("sun.rt.createVmBeginTime", int(time.time() * 1000)),
+            ("sun.rt.javaCommand", "bench.Main"),
+        ] + _COUNTERS
+        with open(os.path.join(self.hsperfdata, str(pid)), "wb") as f:
+            f.write(perfdata(counters))
+
+    def close(self):
+        os.close(self._write_fd)
+        for proc in self.procs:
+            proc.wait()
+        shutil.rmtree(self.hsperfdata, ignore_errors=True)
+
+
+# -- stand-in for the Pushgateway, InfluxDB and service discovery ---------------
+
+class _SinkHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _accept(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(204 if self.path.startswith("/api/v2/write") else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_PUT = do_POST = do_DELETE = do_GET = _accept
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_sink_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _SinkHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# -- worker: runs one strategy in its own process ------------------------------
+
+def _host_forks():
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("processes "):
+                return int(line.split()[1])
+    return 0
+
+
+def _tool_runs():
+    try:
+        return os.path.getsize(os.path.join(os.environ["BENCH_DIR"], "tool-runs"))
+    except OSError:
+        return 0
+
+
+def _measure():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall": time.perf_counter(),
+        "cpu": own.ru_utime + own.ru_stime,
+        "child_cpu": children.ru_utime + children.ru_stime,
+        "tool_runs": _tool_runs(),
+        "forks": _host_forks(),
+        "maxrss": own.ru_maxrss * 1024,
+    }
+
+
+def _load(path: str):
+    # The scripts import their shared modules from their own directory
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location("bench_target", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _cycle_function(path: str, kind: str):
+    if kind == "script":
+        # One-shot script: a cycle is one run of the whole file
+        sys.path.insert(0, os.path.dirname(path))
+        return lambda: runpy.run_path(path, run_name="bench_target")
+    module = _load(path)
+    if kind == "collect":
+        return module.collect
+    if kind == "asyncio":
+        return lambda: module.pushCycle(module.updateStore(module.collectCycleOnLoop()))
+    return module.push_metrics
+
+
+def worker(name: str, cycles: int, result_path: str):
+    script, _, kind = STRATEGIES[name]
+    cycle = _cycle_function(os.path.join(ROOT, script), kind)
+    results = []
+    for _ in range(cycles):
+        before = _measure()
+        cycle()
+        after = _measure()
+        results.append({
+            "wall_seconds": round(after["wall"] - before["wall"], 6),
+            "cpu_seconds": round(after["cpu"] - before["cpu"], 6),
+            "child_cpu_seconds": round(after["child_cpu"] - before["child_cpu"], 6),
+            "tool_runs": after["tool_runs"] - before["tool_runs"],
+            "forks": after["forks"] - before["forks"],
+            "peak_rss_bytes": after["maxrss"],
+        })
+    with open(result_path, "w") as f:
+        json.dump(results, f)
+    # Background threads (samplers, writers) must not keep the worker alive
+    sys.stdout.flush()
+    os._exit(0)
+
+
+# -- driver ---------------------------------------------------------------------
+
+def summarize(cycles):
+    """First cycle (cold caches) and the median of the others (steady state)."""
+    steady = cycles[1:] or cycles
+    summary = {"first_wall_seconds": cycles[0]["wall_seconds"]}
+    for key in ("wall_seconds", "cpu_seconds", "child_cpu_seconds", "tool_runs", "forks"):
+        summary[f"steady_{key}"] = statistics.median(c[key] for c in steady)
+    summary["peak_rss_bytes"] = max(c["peak_rss_bytes"] for c in cycles)
+    return summary
+
+
+def run_strategy(name, jvms, args, workdir, sink_url):
+    _, extra, _ = STRATEGIES[name]
+    env = dict(os.environ)
+    env.update({
+        "PATH": FAKE_JDK + os.pathsep + env.get("PATH", ""),
+        "BENCH_DIR": workdir,
+        "BENCH_LATENCY": str(args.latency),
+        "BENCH_FAIL_PERMILLE": str(int(round(args.failure_rate * 1000))),
+        "HSPERFDATA_TMPDIR": workdir,
+        "PUSHGATEWAY_URL": sink_url,
+        "INFLUXDB_URL": sink_url,
+        "SD_API_URL": sink_url + "/sd",
+        "METADATA_CACHE_PATH": "",
+        "SPOOL_DIR": "",
+        "PUSH_INTERVAL_SECONDS": str(args.cycle_timeout),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    env.update(extra)
+    result_path = os.path.join(workdir, "result.json")
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    log_path = os.path.join(workdir, f"{name.replace('/', '_')}-{jvms}.log")
+    with open(log_path, "w") as log:
+        # Own session, so tools it leaves behind (jstat streams) die with it
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", name,
+             "--cycles", str(args.cycles), "--result", result_path],
+            env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+        try:
+            proc.wait(args.timeout)
+            error = None if proc.returncode == 0 else f"worker exited with {proc.returncode}"
+        except subprocess.TimeoutExpired:
+            error = f"timed out after {args.timeout}s"
+        finally:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.wait()
+    entry = {"strategy": name, "jvms": jvms, "cycles": [], "summary": None, "error": error}
+    if error is None:
+        with open(result_path) as f:
+            entry["cycles"] = json.load(f)
+        entry["summary"] = summarize(entry["cycles"])
+    else:
+        with open(log_path, errors="replace") as f:
+            entry["log_tail"] = f.read()[-2000:]
+    return entry
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ["git", "-C", ROOT, "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the JVM collectors against synthetic JVMs.")
+    parser.add_argument("--jvms", default="1,10,100", help="comma separated fleet sizes (up to a few thousand)")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="comma separated, of: " + ", ".join(STRATEGIES))
+    parser.add_argument("--cycles", type=int, default=3, help="cycles per strategy; the first one runs with cold caches")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every fake tool run takes")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake tool runs that fail")
+    parser.add_argument("--timeout", type=float, default=900, help="seconds one strategy may take for all its cycles")
+    parser.add_argument("--cycle-timeout", type=int, default=300, help="PUSH_INTERVAL_SECONDS (and so the cycle deadline) of the pushers")
+    parser.add_argument("--output", default="-", help="JSON result file, - for stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory with the worker logs")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.cycles, args.result)
+        return
+
+    names = [name.strip() for name in args.strategies.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown strategies: {', '.join(unknown)}")
+    sizes = [int(size) for size in args.jvms.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="jvm-bench-")
+    server = start_sink_server()
+    sink_url = f"http://127.0.0.1:{server.server_address[1]}"
+    report = {
+        "revision": revision(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {"jvms": sizes, "cycles": args.cycles, "latency": args.latency, "failure_rate": args.failure_rate},
+        "results": [],
+    }
+    try:
+        for size in sizes:
+            fleet = Fleet(workdir, size)
+            try:
+                for name in names:
+                    print(f"{name}: {size} JVMs...", file=sys.stderr, flush=True)
+                    entry = run_strategy(name, size, args, workdir, sink_url)
+                    if entry["error"]:
+                        print(f"{name}: {entry['error']}\n{entry['log_tail']}", file=sys.stderr)
+                    report["results"].append(entry)
+            finally:
+                fleet.close()
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
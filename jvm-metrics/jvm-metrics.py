@@ -4,9 +4,18 @@ import traceback
 import socket
 import sys
 import signal
-import requests
-from flask import Flask, Response
-from prometheus_client import CollectorRegistry, Gauge, generate_latest
+import threading
+import time
+import zlib
+from itertools import chain
+from flask import Flask, Response, request
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Copies of jvm-pusher/httptransport.py and selfmetrics.py, shipped next to this script
+# (jvm-pusher/test_copies.py fails when one differs)
+import httptransport
+import selfmetrics
 
 app = Flask(__name__)
 
@@ -17,6 +26,20 @@ SERVICE_PORT = os.getenv("SERVICE_PORT", "9100")
 # Automatically detect the container's internal IP
 SERVICE_HOST = os.getenv("SERVICE_HOST", socket.gethostbyname(socket.gethostname()))
 
+# JVMs are collected in the background; scrapes are served from the last snapshot
+COLLECT_INTERVAL = float(os.getenv("COLLECT_INTERVAL_SECONDS", "15"))
+# A scrape that finds an older snapshot triggers an (coalesced) extra collection
+MAX_SNAPSHOT_AGE = float(os.getenv("MAX_SNAPSHOT_AGE_SECONDS", str(2 * COLLECT_INTERVAL)))
+# How long a scrape waits for the very first snapshot after startup
+FIRST_SCRAPE_WAIT = float(os.getenv("FIRST_SCRAPE_WAIT_SECONDS", "0.5"))
+
+# Pooled keep-alive connections with timeouts, retries and a circuit breaker
+_http = httptransport.Transport.from_env()
+
+# SIGUSR1 / SIGUSR2 start and then dump a cProfile / tracemalloc profile here (empty: off)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/var/tmp/jvm-metrics/profiles")
+_profiler = None
+
 
 
 # For GC metrics, we assume keys like s0c, s1c, oc, and ec
@@ -24,10 +47,11 @@ GC_METRIC_KEYS = ["s0c", "s1c", "oc", "ec"]
 
 def getSysprops(pid: int):
     try:
-        output = subprocess.check_output(
-            f"jinfo -sysprops {pid} | grep -E 'com\\.netfolio\\.(appname|fullname)='",
-            shell=True
-        ).decode()
+        with selfmetrics.tool_run("jinfo"):
+            output = subprocess.check_output(
+                f"jinfo -sysprops {pid} | grep -E 'com\\.netfolio\\.(appname|fullname)='",
+                shell=True
+            ).decode()
         appname, variant = "unknown", "unknown"
         for line in output.splitlines():
             if "com.netfolio.appname" in line:
@@ -41,10 +65,11 @@ def getSysprops(pid: int):
 
 def getHeapSize(pid: int):
     try:
-        output = subprocess.check_output(
-            f"jinfo -flags {pid} | grep -o 'XX:MaxHeapSize=[0-9]\\+'",
-            shell=True
-        ).decode()
+        with selfmetrics.tool_run("jinfo"):
+            output = subprocess.check_output(
+                f"jinfo -flags {pid} | grep -o 'XX:MaxHeapSize=[0-9]\\+'",
+                shell=True
+            ).decode()
         heapSize = 0
         for line in output.splitlines():
             if line.strip():
@@ -61,7 +86,8 @@ def getGCData(pid: int):
             f"jstat -gc {pid} | awk 'NR==1 {{for(i=1; i<=NF; i++) header[i]=$i}} "
             "NR==2 {for(i=1; i<=NF; i++) if(header[i]==\"S0C\" || header[i]==\"S1C\" || header[i]==\"OC\" || header[i]==\"EC\") print header[i] \": \" $i}'"
         )
-        output = subprocess.check_output(cmd, shell=True).decode()
+        with selfmetrics.tool_run("jstat"):
+            output = subprocess.check_output(cmd, shell=True).decode()
         gcData = {}
         for line in output.splitlines():
             if ":" in line:
@@ -77,7 +103,8 @@ def getGCData(pid: int):
 def getPIDs():
     pids = {}
     try:
-        output = subprocess.check_output("jps", shell=True).decode()
+        with selfmetrics.tool_run("jps"):
+            output = subprocess.check_output("jps", shell=True).decode()
         for line in output.strip().splitlines():
             parts = line.split()
             if len(parts) == 2 and parts[1] != "Jps":
@@ -94,16 +121,17 @@ def register_service():
         "labels": {"job": "docker-metrics-service"}
     }
     try:
-        requests.post(SD_API_URL, json=data)
+        _http.request("POST", SD_API_URL, json=data)
         print(f"✅ Registered {SERVICE_HOST}:{SERVICE_PORT} with service discovery at {SD_API_URL}")
     except Exception as e:
         print(f"❌ Failed to register service: {e}")
+        selfmetrics.SINK_ERRORS.labels("service-discovery").inc()
 
 def deregister_service():
     """Deregister this service from the Flask HTTP-SD API."""
     data = {"targets": [f"{SERVICE_HOST}:{SERVICE_PORT}"]}
     try:
-        requests.delete(SD_API_URL, json=data)
+        _http.request("DELETE", SD_API_URL, json=data)
         print(f"🔴 Deregistered {SERVICE_HOST}:{SERVICE_PORT}")
     except Exception as e:
         print(f"⚠️ Failed to deregister service: {e}")
@@ -117,50 +145,150 @@ def handle_shutdown(signal, frame):
 signal.signal(signal.SIGINT, handle_shutdown)  # Ctrl+C
 signal.signal(signal.SIGTERM, handle_shutdown)  # Container shutdown
 
-@app.route('/metrics')
-def metrics():
-    registry = CollectorRegistry()  # Create a custom registry
-
-    # Define the heap size gauge in the custom registry
-    heap_gauge = Gauge(
-        "jvm_heap_size_bytes",
-        "Max heap size in bytes.",
-        ["pid", "appname", "variant"],
-        registry=registry
-    )
-
-    # Define GC metrics gauges in the custom registry
-    gc_gauges = {}
-    for key in GC_METRIC_KEYS:
-        gc_gauges[key] = Gauge(
-            f"jvm_gc_{key}_bytes",
-            f"GC metric for {key}.",
-            ["pid", "appname", "variant"],
-            registry=registry
-        )
+# Last snapshot: {"samples": {pid: (labels, stats)}, "collected_at": epoch, "duration": seconds}
+_snapshot = None
+# Event of the collection in flight, shared by everyone asking for a refresh
+_inflight = None
+_inflight_lock = threading.Lock()
 
-    pids = getPIDs()
-    for pid in pids:
-        sysprops = getSysprops(pid)
-        heap = getHeapSize(pid)
-        gc_stats = getGCData(pid)
+def collect():
+    """Collect all JVMs and publish them as the new snapshot."""
+    global _snapshot
+    started = time.time()
+    samples = {}
 
-        appname = sysprops.get("appname", "unknown")
-        variant = sysprops.get("variant", "unknown")
-        pid_str = str(pid)
+    with selfmetrics.phase("discover"):
+        pids = getPIDs()
+    with selfmetrics.phase("collect"):
+        for pid in pids:
+            sysprops = getSysprops(pid)
+            heap = getHeapSize(pid)
+            gc_stats = getGCData(pid)
 
-        # Set the heap size metric
-        heap_gauge.labels(pid=pid_str, appname=appname, variant=variant).set(heap.get("max_heap_size", 0))
+            appname = sysprops.get("appname", "unknown")
+            variant = sysprops.get("variant", "unknown")
+            samples[pid] = ([str(pid), appname, variant], {"heap": heap, "gc": gc_stats})
+
+    # JVMs that exited simply are not in the new snapshot
+    _snapshot = {
+        "samples": samples,
+        "collected_at": time.time(),
+        "duration": time.time() - started,
+    }
+
+class JvmCollector:
+    """Builds the metric families lazily, one at a time, from the latest snapshot."""
+
+    def collect(self):
+        snapshot = _snapshot
+        if snapshot is None:
+            return
+        samples = snapshot["samples"].values()
+
+        heap_family = GaugeMetricFamily("jvm_heap_size_bytes", "Max heap size in bytes.",
+                                        labels=["pid", "appname", "variant"])
+        for labels, stats in samples:
+            heap_family.add_metric(labels, stats["heap"].get("max_heap_size", 0))
+        yield heap_family
 
-        # Set GC metrics
         for key in GC_METRIC_KEYS:
-            gc_gauges[key].labels(pid=pid_str, appname=appname, variant=variant).set(gc_stats.get(key, 0.0))
+            gc_family = GaugeMetricFamily(f"jvm_gc_{key}_bytes", f"GC metric for {key}.",
+                                          labels=["pid", "appname", "variant"])
+            for labels, stats in samples:
+                gc_family.add_metric(labels, stats["gc"].get(key, 0.0))
+            yield gc_family
+
+        yield GaugeMetricFamily("jvm_metrics_snapshot_age_seconds",
+                                "Seconds since the served snapshot was collected.",
+                                value=max(time.time() - snapshot["collected_at"], 0.0))
+        yield GaugeMetricFamily("jvm_metrics_collection_duration_seconds",
+                                "Duration of the collection that produced the snapshot.",
+                                value=snapshot["duration"])
+
+registry = CollectorRegistry(auto_describe=False)
+registry.register(JvmCollector())
+
+class _Family:
+    """A single metric family as a collector, so generate_latest() renders it on its own."""
+
+    def __init__(self, family):
+        self.family = family
+
+    def collect(self):
+        return [self.family]
+
+def stream_metrics(compress):
+    """Yield the exposition family by family (gzip-compressed if asked)."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    # The collector's own jvm_collector_* families follow the JVM metrics
+    for family in chain(registry.collect(), selfmetrics.REGISTRY.collect()):
+        chunk = generate_latest(_Family(family))
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+def _run_collection(event):
+    global _inflight
+    try:
+        with selfmetrics.CYCLE_SECONDS.time():
+            if _profiler is None:
+                collect()
+            else:
+                _profiler.call(collect)
+    except Exception as e:
+        print(f"Error collecting metrics: {e}")
+        traceback.print_exc()
+    finally:
+        with _inflight_lock:
+            _inflight = None
+        event.set()
+
+def refresh():
+    """
+    Start a collection unless one is already running (single-flight) and
+    return an Event that is set once that collection has finished.
+    """
+    global _inflight
+    with _inflight_lock:
+        if _inflight is not None:
+            return _inflight
+        event = _inflight = threading.Event()
+    threading.Thread(target=_run_collection, args=(event,), daemon=True).start()
+    return event
+
+def collect_periodically():
+    while True:
+        refresh().wait()
+        time.sleep(COLLECT_INTERVAL)
+
+@app.route('/metrics')
+def metrics():
+    snapshot = _snapshot
+    if snapshot is None:
+        refresh().wait(FIRST_SCRAPE_WAIT)
+        snapshot = _snapshot
+        if snapshot is None:
+            return Response("No snapshot collected yet\n", status=503, mimetype='text/plain')
+    elif time.time() - snapshot["collected_at"] > MAX_SNAPSHOT_AGE:
+        # Background collection is late; this scrape still gets the current snapshot
+        refresh()
 
-    return Response(generate_latest(registry), mimetype='text/plain')
+    age = max(time.time() - snapshot["collected_at"], 0.0)
+    headers = {"X-Snapshot-Age-Seconds": f"{age:.3f}", "Vary": "Accept-Encoding"}
+    compress = request.accept_encodings.quality("gzip") > 0
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_metrics(compress), mimetype='text/plain', headers=headers)
 
 if __name__ == '__main__':
+    if PROFILE_DIR:
+        _profiler = selfmetrics.Profiler(PROFILE_DIR)
     try:
         register_service()
+        threading.Thread(target=collect_periodically, name="collector", daemon=True).start()
         app.run(host='0.0.0.0', port=int(SERVICE_PORT))
     finally:
         deregister_service()
\ No newline at end of file
@@ -7,7 +7,7 @@ from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
 
 #declarations
 pid_dictionary={}
-PUSHGATEWAY_HOST="http://pushgateway:9091"
+PUSHGATEWAY_HOST=os.getenv("PUSHGATEWAY_URL", "http://pushgateway:9091")
 
 #functions
 def getSysprops(pid: int):
@@ -0,0 +1,385 @@
+"""
+InfluxDB line-protocol encoding and a batching writer.
+
+Lines accumulate in memory across collection cycles and a background thread
+writes them in one request once `batch_size` lines are pending or the oldest
+one is `flush_interval` seconds old. Collection only appends to a deque, so a
+slow or unreachable InfluxDB never delays sampling; the backlog is bounded and
+drops its oldest lines first. With a spool, batches that fail are kept on disk
+instead and replayed when InfluxDB accepts writes again; a batch InfluxDB
+rejects (bad line, field type conflict, token, too large) is dropped, as
+writing it again would fail the same way.
+"""
+import collections
+import gzip
+import threading
+import time
+from urllib.parse import urlencode
+
+import httptransport
+
+# Same escaping as influxdb_client's Point
+_CONTROL_ESCAPES = {"\n": r"\n", "\t": r"\t", "\r": r"\r"}
+_MEASUREMENT_ESCAPES = str.maketrans({",": r"\,", " ": r"\ ", "\\": "\\\\", **_CONTROL_ESCAPES})
+_TAG_ESCAPES = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ ", "\\": "\\\\", **_CONTROL_ESCAPES})
+_STRING_ESCAPES = str.maketrans({'"': r'\"', "\\": "\\\\"})
+
+
+def escape_measurement(name: str) -> str:
+    return name.translate(_MEASUREMENT_ESCAPES)
+
+
+def escape_tag(value: str) -> str:
+    """Escape a tag key, tag value or field key."""
+    return value.translate(_TAG_ESCAPES)
+
+
+def format_field(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).translate(_STRING_ESCAPES) + '"'
+
+
+def rejected(error) -> bool:
+    """Whether a write failed for good: a 4xx other than 429, not a transport error or 5xx."""
+    return (isinstance(error, httptransport.HTTPError) and error.status < 500
+            and error.status not in httptransport.RETRY_STATUSES)
+
+
+def encode_line(measurement: str, tags: str, fields, timestamp: int) -> str:
+    """One line from an escaped measurement, a pre-encoded ",k=v..." tag string and {field: value}."""
+    encoded = ",".join(f"{escape_tag(key)}={format_field(value)}" for key, value in fields.items())
+    return f"{measurement}{tags} {encoded} {timestamp}"
+
+
+class LineEncoder:
+    """
+    Encodes collected JVM stats straight to line protocol. The escaped tag
+    string of each PID is built once and reused until its labels change.
+    """
+
+    def __init__(self, instance: str, gc_row=False):
+        self.instance = instance
+        # False: one jvm_gc_<column>_kilobytes measurement per column (the
+        # historical layout); True: all columns as fields of one jvm_gc row
+        self.gc_row = gc_row
+        self._tags = {}                 # pid -> ((appname, variant), ",appname=...,instance=...,pid=...,variant=...")
+        self._gc_measurements = {}      # column -> "jvm_gc_<column>_kilobytes"
+        self._field_keys = {}           # column -> escaped field key
+
+    def tags(self, pid, appname: str, variant: str) -> str:
+        cached = self._tags.get(pid)
+        if cached is None or cached[0] != (appname, variant):
+            # Sorted by key, as InfluxDB prefers
+            encoded = (f",appname={escape_tag(appname)},instance={escape_tag(self.instance)}"
+                       f",pid={escape_tag(str(pid))},variant={escape_tag(variant)}")
+            cached = self._tags[pid] = ((appname, variant), encoded)
+        return cached[1]
+
+    def retain(self, pids):
+        """Forget the tag strings of PIDs not in `pids`."""
+        for pid in [pid for pid in self._tags if pid not in pids]:
+            del self._tags[pid]
+
+    def encode(self, collected):
+        """Lines for {pid: {"sysprops", "heap", "gc", "time"}} as collected by the pushers."""
+        lines = []
+        for pid, stats in collected.items():
+            sysprops = stats["sysprops"]
+            tags = self.tags(pid, sysprops.get("appname", "unknown"), sysprops.get("variant", "unknown"))
+            timestamp = stats["time"]
+
+            heap_size = stats["heap"].get("max_heap_size", 0)
+            if heap_size > 0:
+                lines.append(f"jvm_heap_size_bytes{tags} value={int(heap_size)}i {timestamp}")
+
+            gc = stats["gc"]
+            if not gc:
+                continue
+            # min/max/mean/p95 over the interval, when the pusher samples in between
+            window = stats.get("gc_window") or {}
+            stats_of = [(stat, window[stat]) for stat in ("min", "max", "mean", "p95") if stat in window]
+            if self.gc_row:
+                fields = ",".join(f"{self._field_key(key)}={float(value)!r}" for key, value in gc.items())
+                for stat, values in stats_of:
+                    fields += "".join(f",{self._field_key(key)}_{stat}={float(value)!r}" for key, value in values.items())
+                lines.append(f"jvm_gc{tags} {fields} {timestamp}")
+            else:
+                for key, value in gc.items():
+                    fields = f"value={float(value)!r}"
+                    for stat, values in stats_of:
+                        if key in values:
+                            fields += f",{stat}={float(values[key])!r}"
+                    lines.append(f"{self._gc_measurement(key)}{tags} {fields} {timestamp}")
+            # Rates and ratios the pusher derived from consecutive samples
+            derived = stats.get("derived")
+            if derived:
+                fields = ",".join(f"{key}={float(value)!r}" for key, value in derived.items())
+                lines.append(f"jvm_gc_derived{tags} {fields} {timestamp}")
+            # Alert rule states (1 firing, 0 not)
+            alerts = stats.get("alerts")
+            if alerts:
+                fields = ",".join(f"{self._field_key(name)}={int(firing)}i" for name, firing in alerts.items())
+                lines.append(f"jvm_alert{tags} {fields} {timestamp}")
+        return lines
+
+    def _gc_measurement(self, key: str) -> str:
+        measurement = self._gc_measurements.get(key)
+        if measurement is None:
+            measurement = self._gc_measurements[key] = escape_measurement(f"jvm_gc_{key}_kilobytes")
+        return measurement
+
+    def _field_key(self, key: str) -> str:
+        field = self._field_keys.get(key)
+        if field is None:
+            field = self._field_keys[key] = escape_tag(key)
+        return field
+
+
+class InfluxWriter:
+    """Background writer to the v2-compatible /api/v2/write endpoint (InfluxDB 2 and 3)."""
+
+    def __init__(self, transport, url: str, database: str, token: str = "",
+                 batch_size=5000, flush_interval=10.0, max_backlog=100000, compress=True,
+                 spool=None, replay_rate=1024 * 1024):
+        self.transport = transport
+        if "://" not in url:
+            # host:port, as the InfluxDB clients accept it
+            url = f"http://{url}"
+        self.write_url = f"{url.rstrip('/')}/api/v2/write?" + urlencode(
+            {"bucket": database, "precision": "ns"}
+        )
+        self.headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if token:
+            self.headers["Authorization"] = f"Token {token}"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.compress = compress
+        # Optional spool.Spool: failed batches go to disk (gzipped, with their
+        # timestamps) and are replayed oldest first at `replay_rate` bytes/s
+        # once writes succeed again
+        self.spool = spool
+        self.replay_rate = replay_rate
+
+        self._lines = collections.deque()   # (queued_at, line)
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._busy = False                  # a batch is being written
+        self._retry_at = 0.0                # after a failed write, no new attempt before this
+        self._replay_at = 0.0               # replay rate limit
+        self._stopping = False
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_lines = 0
+        self.written_lines = 0
+        self.last_flush_seconds = 0.0
+        self.last_flush_lines = 0
+        self.spooled_batches = 0
+        self.replayed_batches = 0
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, lines):
+        """Queue lines for the next flush; never blocks on the network."""
+        now = time.monotonic()
+        with self._cond:
+            was_empty = not self._lines
+            self._lines.extend((now, line) for line in lines)
+            self._trim()
+            # An idle writer sleeps without a timeout until the first line arrives
+            if was_empty or len(self._lines) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Write everything queued so far. Returns True once the backlog is empty,
+        False if a write failed or `timeout` expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            failures = self.failed_flushes
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._lines or self._busy) and self.failed_flushes == failures and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self._lines
+
+    def close(self, timeout=10.0) -> bool:
+        """
+        Flush what is left (bounded by `timeout`) and stop the writer thread.
+        With a spool, lines that could not be written are spooled instead of lost.
+        """
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(1.0)
+        if self.spool is not None:
+            with self._cond:
+                remaining = [line for _, line in self._lines]
+                self._lines.clear()
+            if remaining:
+                self._spool_lines(remaining)
+                flushed = True
+            self.spool.close()
+        return flushed
+
+    def stats(self) -> dict:
+        with self._cond:
+            oldest = self._lines[0][0] if self._lines else None
+            stats = {
+                "backlog_lines": len(self._lines),
+                "oldest_line_age_seconds": 0.0 if oldest is None else time.monotonic() - oldest,
+                "last_flush_seconds": self.last_flush_seconds,
+                "last_flush_lines": self.last_flush_lines,
+                "written_lines": self.written_lines,
+                "dropped_lines": self.dropped_lines,
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+            }
+        if self.spool is not None:
+            stats["spool_pending_bytes"] = self.spool.pending_bytes
+            stats["spool_dropped_bytes"] = self.spool.dropped_bytes
+            stats["spooled_batches"] = self.spooled_batches
+            stats["replayed_batches"] = self.replayed_batches
+        return stats
+
+    def _trim(self):
+        overflow = len(self._lines) - self.max_backlog
+        if overflow > 0:
+            for _ in range(overflow):
+                self._lines.popleft()
+            self.dropped_lines += overflow
+
+    def _due(self) -> bool:
+        if not self._lines:
+            return False
+        if self._flush_requested:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        return (len(self._lines) >= self.batch_size
+                or time.monotonic() - self._lines[0][0] >= self.flush_interval)
+
+    def _replay_due(self) -> bool:
+        now = time.monotonic()
+        return (self.spool is not None and now >= self._retry_at and now >= self._replay_at
+                and self.spool.pending_bytes > 0)
+
+    def _wait_timeout(self):
+        timeouts = []
+        if self._lines:
+            timeouts.append(max(self._lines[0][0] + self.flush_interval, self._retry_at))
+        if self.spool is not None and self.spool.pending_bytes > 0:
+            timeouts.append(max(self._replay_at, self._retry_at))
+        if not timeouts:
+            return None
+        return max(min(timeouts) - time.monotonic(), 0.0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due() and not self._replay_due():
+                    self._cond.wait(self._wait_timeout())
+                if self._stopping:
+                    return
+                batch = None
+                if self._due():
+                    batch = [self._lines.popleft() for _ in range(min(self.batch_size, len(self._lines)))]
+                    self._busy = True
+
+            if batch is None:
+                self._replay()
+                continue
+
+            started = time.monotonic()
+            error = self._post("\n".join(line for _, line in batch), self.compress)
+            elapsed = time.monotonic() - started
+            dropped = rejected(error)
+
+            with self._cond:
+                self._busy = False
+                self.last_flush_seconds = elapsed
+                if error is None:
+                    self.flushes += 1
+                    self.written_lines += len(batch)
+                    self.last_flush_lines = len(batch)
+                    self._retry_at = 0.0
+                elif dropped:
+                    print(f"InfluxDB rejected {len(batch)} lines, dropping them: {error}")
+                    self.failed_flushes += 1
+                    self.dropped_lines += len(batch)
+                else:
+                    print(f"Failed to write {len(batch)} lines to InfluxDB: {error}")
+                    self.failed_flushes += 1
+                    # The transport already retried, so wait a flush interval
+                    self._retry_at = time.monotonic() + self.flush_interval
+                    self._flush_requested = False
+                    if self.spool is None:
+                        # Keep order: the failed batch goes back in front of newer lines
+                        self._lines.extendleft(reversed(batch))
+                        self._trim()
+                if not self._lines:
+                    self._flush_requested = False
+                self._cond.notify_all()
+            if error is not None and not dropped and self.spool is not None:
+                self._spool_lines([line for _, line in batch])
+
+    def _spool_lines(self, lines):
+        try:
+            self.spool.append(gzip.compress("\n".join(lines).encode(), compresslevel=5))
+            self.spooled_batches += 1
+        except OSError as e:
+            with self._cond:
+                self.dropped_lines += len(lines)
+            print(f"Failed to spool {len(lines)} lines, dropping them: {e}")
+
+    def _replay(self):
+        """Write the oldest spooled batch."""
+        try:
+            entry = self.spool.peek()
+        except OSError as e:
+            print(f"Failed to read the spool: {e}")
+            entry = None
+        if entry is None:
+            with self._cond:
+                self._replay_at = time.monotonic() + self.flush_interval
+            return
+        token, payload = entry
+        error = self._post(payload, False, {"Content-Encoding": "gzip"})
+        dropped = rejected(error)
+        lines = 0
+        if dropped:
+            try:
+                lines = gzip.decompress(payload).count(b"\n") + 1
+            except (OSError, EOFError):
+                pass
+        with self._cond:
+            if error is None:
+                self.replayed_batches += 1
+                self._replay_at = time.monotonic() + len(payload) / self.replay_rate
+            elif dropped:
+                print(f"InfluxDB rejected a spooled batch of {lines} lines, dropping it: {error}")
+                self.dropped_lines += lines
+            else:
+                print(f"Failed to replay spooled batch to InfluxDB: {error}")
+                self._retry_at = time.monotonic() + self.flush_interval
+        if error is None or dropped:
+            self.spool.ack(token)
+
+    def _post(self, body, compress, extra_headers=None):
+        """Write one request body; returns the exception on failure, else None."""
+        headers = self.headers if extra_headers is None else {**self.headers, **extra_headers}
+        try:
+            self.transport.request("POST", self.write_url, body=body, headers=headers, compress=compress)
+        except Exception as e:
+            return e
+        return None
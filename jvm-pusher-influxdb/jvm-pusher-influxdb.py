@@ -4,14 +4,36 @@ import traceback
 import socket
 import time
 import signal
-from influxdb_client_3 import InfluxDBClient3, Point
+
+# Copies of jvm-pusher/httptransport.py, influxsink.py and spool.py, shipped next to this script
+# (jvm-pusher/test_copies.py fails when one differs)
+import httptransport
+import influxsink
+import spool
 
 # Load configurations
 INFLUXDB_URL      = os.getenv("INFLUXDB_URL",      "http://localhost:8086")
 INFLUXDB_TOKEN    = os.getenv("INFLUXDB_TOKEN",    "")
 INFLUXDB_DATABASE = os.getenv("INFLUXDB_DATABASE", "jvm-metrics")
+# Sampling interval; writes are batched independently (see INFLUXDB_FLUSH_*)
 PUSH_INTERVAL     = int(os.getenv("PUSH_INTERVAL_SECONDS", "15"))
 INSTANCE          = os.getenv("INSTANCE",          socket.gethostname())
+# gzip write bodies (InfluxDB accepts Content-Encoding: gzip)
+INFLUXDB_GZIP     = os.getenv("INFLUXDB_GZIP",     "true").lower() == "true"
+# Points are written in the background once this many lines are queued or the
+# oldest is this old; at most INFLUXDB_MAX_BACKLOG lines wait (oldest dropped)
+INFLUXDB_BATCH_SIZE     = int(os.getenv("INFLUXDB_BATCH_SIZE",     "5000"))
+INFLUXDB_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_FLUSH_INTERVAL_SECONDS", "10"))
+INFLUXDB_MAX_BACKLOG    = int(os.getenv("INFLUXDB_MAX_BACKLOG",    "100000"))
+# "measurements" writes each GC column as jvm_gc_<column>_kilobytes; "row" packs
+# all columns as fields of one jvm_gc row per JVM (fewer series, smaller payload)
+INFLUXDB_GC_LAYOUT      = os.getenv("INFLUXDB_GC_LAYOUT", "measurements")
+# Batches that fail to write are spooled here (empty disables) and replayed,
+# oldest first and rate-limited, once InfluxDB is reachable again
+SPOOL_DIR               = os.getenv("SPOOL_DIR", "/var/tmp/jvm-pusher-influxdb/spool")
+SPOOL_MAX_BYTES         = int(os.getenv("SPOOL_MAX_BYTES", str(256 * 1024 * 1024)))
+SPOOL_SEGMENT_BYTES     = int(os.getenv("SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+SPOOL_REPLAY_RATE       = int(os.getenv("SPOOL_REPLAY_BYTES_PER_SECOND", str(1024 * 1024)))
 
 shutdown_flag = False
 
@@ -19,6 +41,31 @@ shutdown_flag = False
 _sysprops_cache = {}
 _heap_cache = {}
 
+# Pooled keep-alive connections with timeouts, retries and a circuit breaker
+_http = httptransport.Transport.from_env()
+
+# Failed batches wait here for replay (None: SPOOL_DIR empty or unusable)
+_spool = None
+if SPOOL_DIR:
+    try:
+        _spool = spool.Spool(SPOOL_DIR, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES)
+    except OSError as e:
+        print(f"Spool disabled, cannot use {SPOOL_DIR}: {e}")
+
+# One long-lived writer batching points across cycles
+_writer = influxsink.InfluxWriter(
+    _http, INFLUXDB_URL, INFLUXDB_DATABASE, INFLUXDB_TOKEN,
+    batch_size=INFLUXDB_BATCH_SIZE,
+    flush_interval=INFLUXDB_FLUSH_INTERVAL,
+    max_backlog=INFLUXDB_MAX_BACKLOG,
+    compress=INFLUXDB_GZIP,
+    spool=_spool,
+    replay_rate=SPOOL_REPLAY_RATE
+)
+# Encodes collected stats straight to line protocol with cached per-PID tags
+_encoder = influxsink.LineEncoder(INSTANCE, gc_row=INFLUXDB_GC_LAYOUT == "row")
+_writer_tags = f",instance={influxsink.escape_tag(INSTANCE)}"
+
 def getSysprops(pid: int):
     # Check if PID still exists before using cache
     if pid not in _sysprops_cache:
@@ -126,6 +173,10 @@ def getPIDs():
         print(f"Unexpected error retrieving PIDs: {e}")
     return pids
 
+def writerStatsLine():
+    """The writer's flush latency and backlog, written along with the JVM metrics."""
+    return influxsink.encode_line("jvm_pusher_influx_writer", _writer_tags, _writer.stats(), time.time_ns())
+
 def push_metrics():
     # Clear caches at the start of each cycle to avoid stale data
     global _sysprops_cache, _heap_cache
@@ -134,6 +185,7 @@ def push_metrics():
     # Remove entries for PIDs that no longer exist
     _sysprops_cache = {pid: _sysprops_cache[pid] for pid in current_pids if pid in _sysprops_cache}
     _heap_cache = {pid: _heap_cache[pid] for pid in current_pids if pid in _heap_cache}
+    _encoder.retain(current_pids)
     
     pids = current_pids
     collected = {}
@@ -153,7 +205,8 @@ def push_metrics():
             heap = getHeapSize(pid)
             gc = getGCData(pid)
 
-            collected[pid] = {"sysprops": sysprops, "heap": heap, "gc": gc}
+            # Points are written later, so they carry their collection time
+            collected[pid] = {"sysprops": sysprops, "heap": heap, "gc": gc, "time": time.time_ns()}
         except Exception as e:
             # Skip this PID if there's an error, but continue with others
             print(f"Error collecting metrics for PID {pid}: {e}")
@@ -163,59 +216,13 @@ def push_metrics():
         print("No metrics collected, skipping push")
         return
 
-    # Create InfluxDB 3 client
     try:
-        client = InfluxDBClient3(
-            token=INFLUXDB_TOKEN,
-            host=INFLUXDB_URL,
-            database=INFLUXDB_DATABASE
-        )
-        
-        points = []
-        
-        # Create points for each PID's metrics
-        for pid, stats in collected.items():
-            pid_str = str(pid)
-            appname = stats["sysprops"].get("appname", "unknown")
-            variant = stats["sysprops"].get("variant", "unknown")
-            
-            # Tags for InfluxDB (indexed fields)
-            tags = {
-                "pid": pid_str,
-                "appname": appname,
-                "variant": variant,
-                "instance": INSTANCE
-            }
-            
-            # Heap size metric
-            heap_size = stats["heap"].get("max_heap_size", 0)
-            if heap_size > 0:
-                point = Point("jvm_heap_size_bytes")
-                for tag_key, tag_value in tags.items():
-                    point = point.tag(tag_key, tag_value)
-                point = point.field("value", heap_size)
-                points.append(point)
-            
-            # GC capacity metrics (from jstat -gccapacity)
-            for gc_key, gc_value in stats["gc"].items():
-                # Convert GC key to metric name (e.g., "s0c" -> "jvm_gc_capacity_s0c_bytes")
-                # Note: jstat -gccapacity outputs values in KB, we convert to bytes
-                metric_name = f"jvm_gc_{gc_key}_kilobytes"
-                point = Point(metric_name)
-                for tag_key, tag_value in tags.items():
-                    point = point.tag(tag_key, tag_value)
-                # Convert from KB to bytes (jstat -gccapacity reports in KB)
-                point = point.field("value", float(gc_value))
-                points.append(point)
-        
-        # Write all points to InfluxDB 3 (supports batch writes)
-        if points:
-            # InfluxDB 3 client.write() accepts a list of points
-            client.write(record=points)
-            print(f"Successfully pushed {len(points)} metrics to InfluxDB 3 ({INFLUXDB_URL})")
-        
-        client.close()
-        
+        lines = _encoder.encode(collected)
+        lines.append(writerStatsLine())
+        # Queue for the background writer; flushes happen by size/age
+        _writer.write(lines)
+        stats = _writer.stats()
+        print(f"Queued {len(lines)} metrics for InfluxDB 3 ({INFLUXDB_URL}), backlog {stats['backlog_lines']} lines, last flush {stats['last_flush_seconds']:.3f}s")
     except Exception as e:
         print(f"Failed to push metrics to InfluxDB 3: {e}")
         traceback.print_exc()
@@ -247,4 +254,7 @@ if __name__ == '__main__':
         if not shutdown_flag:
             time.sleep(PUSH_INTERVAL)   
     
+    if not _writer.close(timeout=10):
+        print(f"Dropped {_writer.stats()['backlog_lines']} unwritten lines on shutdown")
+    _http.close()
     print("Shutdown complete.")
@@ -0,0 +1,207 @@
+"""
+Append-only, size-capped on-disk spool for batches a sink could not take.
+
+Batches are stored as length-prefixed, checksummed records in numbered segment
+files. A cursor file remembers how far replay got, so a restart resumes where
+it stopped. Consumed segments are deleted; when the spool is over its cap the
+partly consumed head segment is compacted first and then the oldest segments
+are dropped, so disk use stays bounded and the newest data survives.
+"""
+import os
+import struct
+import threading
+import zlib
+
+_HEADER = struct.Struct("<II")          # payload length, crc32
+_SUFFIX = ".seg"
+_CURSOR = "cursor"
+
+
+class Spool:
+    def __init__(self, directory: str, max_bytes=256 * 1024 * 1024, segment_bytes=8 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped_bytes = 0
+        self._lock = threading.Lock()
+        self._sizes = {}                # segment id -> file size
+        for name in os.listdir(directory):
+            if name.endswith(_SUFFIX) and name[:-len(_SUFFIX)].isdigit():
+                self._sizes[int(name[:-len(_SUFFIX)])] = os.path.getsize(os.path.join(directory, name))
+        self._segments = sorted(self._sizes)
+        if self._segments:
+            self._repair(self._segments[-1])
+        self._file = None
+        self._read_segment, self._read_offset = self._load_cursor()
+        while self._segments and self._segments[0] < self._read_segment:
+            # Consumed before a crash but not deleted yet
+            self._drop_head()
+
+    # -- public API --------------------------------------------------------
+
+    @property
+    def pending_bytes(self) -> int:
+        """Bytes not replayed yet (record headers included)."""
+        with self._lock:
+            return self._pending()
+
+    def append(self, payload: bytes):
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if (not self._segments
+                    or 0 < self._sizes[self._segments[-1]] and
+                    self._sizes[self._segments[-1]] + len(record) > self.segment_bytes):
+                self._rotate()
+            f = self._writer()
+            f.write(record)
+            f.flush()
+            self._sizes[self._segments[-1]] += len(record)
+            if self._total() > self.max_bytes:
+                self._enforce_cap()
+
+    def peek(self):
+        """The oldest unreplayed batch as (token, payload), or None if the spool is drained."""
+        with self._lock:
+            while self._segments:
+                segment, offset = self._read_segment, self._read_offset
+                if offset >= self._sizes[segment]:
+                    if segment == self._segments[-1]:
+                        return None
+                    self._drop_head()
+                    continue
+                with open(self._path(segment), "rb") as f:
+                    f.seek(offset)
+                    header = f.read(_HEADER.size)
+                    length, crc = _HEADER.unpack(header) if len(header) == _HEADER.size else (0, None)
+                    payload = f.read(length) if crc is not None else b""
+                if crc is None or len(payload) != length or zlib.crc32(payload) != crc:
+                    # Damaged record: the rest of the segment cannot be framed
+                    print(f"Spool segment {self._path(segment)} is damaged at offset {offset}, skipping its rest")
+                    self.dropped_bytes += self._sizes[segment] - offset
+                    self._read_offset = self._sizes[segment]
+                    if segment == self._segments[-1]:
+                        self._rotate()
+                    continue
+                return (segment, offset, offset + _HEADER.size + length), payload
+            return None
+
+    def ack(self, token):
+        """Mark the batch returned by peek() as replayed."""
+        segment, offset, next_offset = token
+        with self._lock:
+            if (self._read_segment, self._read_offset) != (segment, offset):
+                return
+            self._read_offset = next_offset
+            if next_offset >= self._sizes[segment] and segment != self._segments[-1]:
+                self._drop_head()
+            self._save_cursor()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # -- internals (called with the lock held) -----------------------------
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:012d}{_SUFFIX}")
+
+    def _total(self) -> int:
+        return sum(self._sizes.values())
+
+    def _pending(self) -> int:
+        if not self._segments:
+            return 0
+        return self._total() - self._read_offset
+
+    def _writer(self):
+        if self._file is None:
+            self._file = open(self._path(self._segments[-1]), "ab")
+        return self._file
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        segment = self._segments[-1] + 1 if self._segments else 1
+        open(self._path(segment), "ab").close()
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+        if len(self._segments) == 1:
+            self._read_segment, self._read_offset = segment, 0
+
+    def _drop_head(self):
+        """Delete the head segment (consumed or evicted; never the one being written)."""
+        segment = self._segments.pop(0)
+        del self._sizes[segment]
+        try:
+            os.remove(self._path(segment))
+        except OSError:
+            pass
+        self._read_segment, self._read_offset = self._segments[0], 0
+        self._save_cursor()
+
+    def _compact_head(self):
+        """Rewrite the head segment without its replayed prefix."""
+        segment, offset = self._read_segment, self._read_offset
+        if offset == 0 or segment == self._segments[-1]:
+            return
+        path = self._path(segment)
+        tmp = path + ".tmp"
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            src.seek(offset)
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        os.replace(tmp, path)
+        self._sizes[segment] -= offset
+        self._read_offset = 0
+        self._save_cursor()
+
+    def _enforce_cap(self):
+        self._compact_head()
+        while self._total() > self.max_bytes and len(self._segments) > 1:
+            self.dropped_bytes += self._sizes[self._segments[0]] - self._read_offset
+            self._drop_head()
+
+    def _repair(self, segment: int):
+        """Cut a torn record (crash in the middle of an append) off the last segment."""
+        path = self._path(segment)
+        good = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    break
+                good += _HEADER.size + length
+        if good != self._sizes[segment]:
+            with open(path, "r+b") as f:
+                f.truncate(good)
+            self._sizes[segment] = good
+
+    def _load_cursor(self):
+        first = self._segments[0] if self._segments else 0
+        try:
+            with open(os.path.join(self.directory, _CURSOR)) as f:
+                segment, offset = (int(x) for x in f.read().split())
+        except (OSError, ValueError):
+            return first, 0
+        if segment not in self._sizes:
+            # Its segment is gone (consumed or evicted): start at the oldest one left
+            return first, 0
+        return segment, min(offset, self._sizes[segment])
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, _CURSOR)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{self._read_segment} {self._read_offset}")
+        os.replace(tmp, path)
@@ -0,0 +1,119 @@
+"""
+Local threshold rules checked on every fresh sample of a JVM.
+
+A rule is `name:metric>threshold` (or `<`), optionally `/clear`: it fires
+when the metric crosses the threshold and resolves only once it is back past
+`clear`, so a value hovering at the threshold does not flap. Whoever owns the
+RuleSet pushes a JVM's state out of band when one of its rules changes;
+take_push() spaces those pushes at least `min_interval` apart per JVM.
+"""
+import re
+import threading
+import time
+
+_RULE = re.compile(r"^(\w+):(\w+)([<>])([-+0-9.eE]+)(?:/([-+0-9.eE]+))?$")
+
+
+class Rule:
+    def __init__(self, name: str, metric: str, above: bool, threshold: float, clear: float):
+        self.name = name
+        self.metric = metric            # jstat -gc column or derived metric
+        self.above = above              # fires above (True) or below the threshold
+        self.threshold = threshold
+        self.clear = clear
+
+    def __str__(self):
+        return f"{self.metric}{'>' if self.above else '<'}{self.threshold:g}"
+
+    def check(self, value: float, firing: bool) -> bool:
+        """Whether the rule fires after seeing `value`, given whether it fired before."""
+        if self.above:
+            return value > (self.clear if firing else self.threshold)
+        return value < (self.clear if firing else self.threshold)
+
+
+def parse_rules(spec: str, hysteresis: float):
+    """
+    Rules from "name:metric>threshold[/clear],...". Without an explicit clear
+    value a rule resolves `hysteresis` (a fraction of the threshold) past it.
+    """
+    rules = []
+    for text in spec.replace(" ", "").split(","):
+        if not text:
+            continue
+        match = _RULE.match(text)
+        if match is None:
+            print(f"Ignoring alert rule '{text}': expected name:metric>threshold[/clear]")
+            continue
+        name, metric, op, threshold, clear = match.groups()
+        try:
+            threshold = float(threshold)
+            above = op == ">"
+            if clear is None:
+                clear = threshold * (1 - hysteresis if above else 1 + hysteresis)
+            rules.append(Rule(name, metric, above, threshold, float(clear)))
+        except ValueError:
+            print(f"Ignoring alert rule '{text}': threshold is not a number")
+    return rules
+
+
+class RuleSet:
+    def __init__(self, rules, min_interval: float):
+        self.rules = {rule.name: rule for rule in rules}
+        self.min_interval = min_interval
+        self._firing = {}               # pid -> names of the rules firing
+        self._pushed = {}               # pid -> monotonic time of its last out-of-band push
+        self._pending = set()           # PIDs with a change held back by min_interval
+        self._lock = threading.Lock()
+
+    def evaluate(self, pid: int, values) -> bool:
+        """Apply one sample ({metric: value}); True if a rule fired or resolved."""
+        with self._lock:
+            firing = self._firing.get(pid, frozenset())
+            now_firing = set(firing)
+            for rule in self.rules.values():
+                value = values.get(rule.metric)
+                if value is None:
+                    # Not in this sample (e.g. a rate before the second one): keep the state
+                    continue
+                if rule.check(value, rule.name in firing):
+                    now_firing.add(rule.name)
+                else:
+                    now_firing.discard(rule.name)
+            self._firing[pid] = frozenset(now_firing)
+            return now_firing != firing
+
+    def states(self, pid: int):
+        """{rule name: 1 if firing else 0} of `pid`."""
+        with self._lock:
+            firing = self._firing.get(pid, frozenset())
+        return {name: 1 if name in firing else 0 for name in self.rules}
+
+    def take_push(self, pid: int, changed: bool) -> bool:
+        """
+        Whether to push `pid` out of band now: after a change, unless it was
+        pushed less than min_interval ago, in which case the push is held
+        back until then (or until a regular push, see sync()).
+        """
+        with self._lock:
+            if not changed and pid not in self._pending:
+                return False
+            now = time.monotonic()
+            if now - self._pushed.get(pid, float("-inf")) < self.min_interval:
+                self._pending.add(pid)
+                return False
+            self._pending.discard(pid)
+            self._pushed[pid] = now
+            return True
+
+    def sync(self, pids):
+        """
+        Called with the live PIDs before each cycle, whose regular push
+        carries every rule state: drops held back pushes and forgets PIDs
+        not in `pids`.
+        """
+        with self._lock:
+            self._pending.clear()
+            for pid in [pid for pid in self._firing if pid not in pids]:
+                del self._firing[pid]
+                self._pushed.pop(pid, None)
@@ -0,0 +1,93 @@
+"""
+Derived GC metrics from two consecutive `jstat -gc` samples of the same JVM.
+
+The raw columns are cumulative counters (YGC, GCT...) and point-in-time sizes
+(EU, OU...); turning them into rates over the fleet is heavy at query time.
+The tracker keeps the previous sample per (pid, start ticks), so a reused PID
+starts over, and a counter that went backwards (the JVM restarted) is treated
+as a reset rather than a negative rate.
+"""
+import threading
+
+import procfs
+
+_KB = 1024.0
+
+# Derived metric -> help text; pushed as jvm_<name>
+METRICS = {
+    "gc_time_fraction":                "Fraction of wall time spent in GC since the previous sample.",
+    "gc_young_collections_per_second": "Young collections per second since the previous sample.",
+    "gc_full_collections_per_second":  "Full collections per second since the previous sample.",
+    "gc_allocation_bytes_per_second":  "Bytes allocated in eden per second since the previous sample.",
+    "gc_promotion_bytes_per_second":   "Old generation growth per second since the previous sample (no full GC in between).",
+    "gc_old_occupancy_ratio":          "Old generation used / capacity (OU/OC).",
+}
+
+# Cumulative columns: going down means the JVM behind the PID started over
+_COUNTERS = ("ygc", "ygct", "fgc", "fgct", "gct")
+
+
+def point_metrics(gc: dict) -> dict:
+    """The derived metrics a single sample is enough for."""
+    ou, oc = gc.get("ou"), gc.get("oc")
+    if ou is not None and oc:
+        return {"gc_old_occupancy_ratio": round(ou / oc, 6)}
+    return {}
+
+
+class RateTracker:
+    """
+    Rates span at least `min_seconds`: a sample closer to the previous one
+    only gets point_metrics(). `identity(pid)` tells the processes behind a
+    PID apart (None: unknown, the previous one is assumed).
+    """
+
+    def __init__(self, min_seconds: float = 0.0, identity=procfs.start_ticks):
+        self.min_seconds = min_seconds
+        self.identity = identity
+        self._previous = {}             # pid -> (start ticks, time ns, gc)
+        self._lock = threading.Lock()
+
+    def update(self, pid: int, gc: dict, time_ns: int) -> dict:
+        """Derived metrics ({name: value}, names from METRICS) of this sample; remembers it for the next one."""
+        derived = point_metrics(gc)
+        ticks = self.identity(pid)
+        with self._lock:
+            previous = self._previous.get(pid)
+            if previous is not None and ticks is None:
+                # Exited JVM, sampled one last time from its mapped file: still the same process
+                ticks = previous[0]
+            same = previous is not None and previous[0] == ticks
+            if same and 0 <= time_ns - previous[1] < self.min_seconds * 1e9:
+                # Too close for a meaningful rate: keep measuring from the previous sample
+                return derived
+            self._previous[pid] = (ticks, time_ns, gc)
+        if not same:
+            return derived
+        _, previous_ns, last = previous
+        seconds = (time_ns - previous_ns) / 1e9
+        if seconds <= 0 or any(gc.get(c, 0) < last.get(c, 0) for c in _COUNTERS):
+            return derived
+
+        if "gct" in gc and "gct" in last:
+            derived["gc_time_fraction"] = round(min(max((gc["gct"] - last["gct"]) / seconds, 0.0), 1.0), 6)
+        if "ygc" in gc and "ygc" in last:
+            derived["gc_young_collections_per_second"] = round((gc["ygc"] - last["ygc"]) / seconds, 6)
+        if "fgc" in gc and "fgc" in last:
+            derived["gc_full_collections_per_second"] = round((gc["fgc"] - last["fgc"]) / seconds, 6)
+
+        young = gc.get("ygc", 0) - last.get("ygc", 0)
+        if "eu" in gc and "eu" in last:
+            # Each young GC empties eden, which was about full (EC) when it ran
+            allocated = gc["eu"] - last["eu"] + young * last.get("ec", 0)
+            derived["gc_allocation_bytes_per_second"] = round(max(allocated, 0.0) * _KB / seconds, 1)
+        if "ou" in gc and "ou" in last and gc.get("fgc", 0) == last.get("fgc", 0):
+            # A full GC in between shrinks old gen by an unknown amount: no estimate then
+            derived["gc_promotion_bytes_per_second"] = round(max(gc["ou"] - last["ou"], 0.0) * _KB / seconds, 1)
+        return derived
+
+    def retain(self, pids):
+        """Forget the samples of PIDs not in `pids`."""
+        with self._lock:
+            for pid in [pid for pid in self._previous if pid not in pids]:
+                del self._previous[pid]
@@ -0,0 +1,300 @@
+"""
+Reader for HotSpot PerfData (hsperfdata) files.
+
+Every JVM started with -XX:+UsePerfData (the default) exports its
+instrumentation counters through a memory mapped file at
+/tmp/hsperfdata_<user>/<pid>. jstat and jps read exactly this file after
+paying for a JVM start of their own; mapping it here gives the same numbers
+without forking anything.
+"""
+import glob
+import mmap
+import os
+import struct
+
+import procfs
+
+HSPERFDATA_TMPDIR = os.getenv("HSPERFDATA_TMPDIR", "/tmp")
+
+PERFDATA_MAGIC = 0xCAFEC0C0
+
+# Prologue layout after the 4 byte magic and 1 byte byte_order:
+# major(1) minor(1) accessible(1) used(4) overflow(4) mod_time_stamp(8)
+# entry_offset(4) num_entries(4)
+_PROLOGUE_FMT = "BBBiiqii"
+# Entry header: entry_length(4) name_offset(4) vector_length(4) data_type(1)
+# flags(1) data_units(1) data_variability(1) data_offset(4)
+_ENTRY_FMT = "iiiBBBBi"
+
+_TYPE_LONG = ord("J")
+_TYPE_BYTE = ord("B")
+
+_KB = 1024.0
+
+# Open files, keyed by pid
+_perfdata = {}
+
+
+class PerfData:
+    """A read-only mapping of one hsperfdata file plus a name -> offset index."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.ident = (st.st_dev, st.st_ino)
+
+        magic = struct.unpack_from(">I", self._mm, 0)[0]
+        if magic != PERFDATA_MAGIC:
+            self.close()
+            raise ValueError(f"{path}: bad PerfData magic {magic:#x}")
+        order = "<" if self._mm[4] == 1 else ">"
+        self._prologue = struct.Struct(order + _PROLOGUE_FMT)
+        self._entry = struct.Struct(order + _ENTRY_FMT)
+        self._long = struct.Struct(order + "q")
+        self._num_entries = 0
+        self._index = {}
+        self.refresh()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    @property
+    def closed(self) -> bool:
+        return self._mm is None
+
+    @property
+    def accessible(self) -> bool:
+        return self._mm is not None and self._prologue.unpack_from(self._mm, 5)[2] != 0
+
+    def refresh(self):
+        """Index entries added since the last call (the JVM only ever appends)."""
+        _, _, _, _, _, _, entry_offset, num_entries = self._prologue.unpack_from(self._mm, 5)
+        if num_entries == self._num_entries:
+            return
+        mm = self._mm
+        offset = entry_offset
+        for i in range(num_entries):
+            (entry_length, name_offset, vector_length, data_type,
+             _, _, _, data_offset) = self._entry.unpack_from(mm, offset)
+            if entry_length <= 0:
+                break
+            if i >= self._num_entries:
+                name_start = offset + name_offset
+                name = mm[name_start:mm.find(b"\0", name_start)].decode("ascii", "replace")
+                self._index[name] = (data_type, vector_length, offset + data_offset)
+            offset += entry_length
+        self._num_entries = num_entries
+
+    def long(self, name: str, default=None):
+        entry = self._index.get(name)
+        if entry is None or entry[0] != _TYPE_LONG or entry[1] != 0:
+            return default
+        return self._long.unpack_from(self._mm, entry[2])[0]
+
+    def string(self, name: str, default=None):
+        entry = self._index.get(name)
+        if entry is None or entry[0] != _TYPE_BYTE:
+            return default
+        start = entry[2]
+        end = self._mm.find(b"\0", start, start + entry[1])
+        if end < 0:
+            end = start + entry[1]
+        return self._mm[start:end].decode("utf-8", "replace")
+
+    def get(self, name: str, default=None):
+        """Value of a scalar long or string counter, like dict.get."""
+        entry = self._index.get(name)
+        if entry is None:
+            return default
+        if entry[0] == _TYPE_LONG:
+            return self.long(name, default)
+        return self.string(name, default)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+
+def find_perfdata_file(pid: int):
+    """Return the hsperfdata file of `pid` under any user's directory, or None."""
+    matches = glob.glob(os.path.join(HSPERFDATA_TMPDIR, "hsperfdata_*", str(pid)))
+    return matches[0] if matches else None
+
+
+def list_jvms():
+    """
+    Return {pid: main_class} for all running JVMs, like `jps` prints them, or
+    None when there is no hsperfdata directory at all (nothing to scan).
+
+    A file only counts if /proc/<pid> exists and the process started before
+    the JVM recorded its creation, which rejects files left behind by a
+    crashed JVM whose PID was reused by another process.
+    """
+    directories = glob.glob(os.path.join(HSPERFDATA_TMPDIR, "hsperfdata_*"))
+    if not directories:
+        return None
+    jvms = {}
+    for directory in directories:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            # Another user's directory we may not read
+            continue
+        for name in names:
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            started = procfs.start_time(pid)
+            if started is None:
+                continue
+            perfdata = open_perfdata(pid)
+            if perfdata is None:
+                continue
+            try:
+                vm_begin = perfdata.long("sun.rt.createVmBeginTime")
+                command = perfdata.string("sun.rt.javaCommand", "")
+            except ValueError:
+                continue
+            # btime only has a one second resolution, hence the slack
+            if vm_begin is not None and vm_begin / 1000.0 < started - 2.0:
+                continue
+            main_class = _main_class(command)
+            if main_class:
+                jvms[pid] = main_class
+    return jvms
+
+
+def _main_class(command: str) -> str:
+    """Short main class (or jar file) name from sun.rt.javaCommand, as jps shows it."""
+    parts = command.split(None, 1)
+    if not parts:
+        return ""
+    main = parts[0]
+    if main.endswith(".jar"):
+        return os.path.basename(main)
+    return main.rsplit(".", 1)[-1]
+
+
+def open_perfdata(pid: int):
+    """Return a (cached) PerfData for `pid`, or None if it has no usable file."""
+    perfdata = _perfdata.get(pid)
+    if perfdata is not None:
+        try:
+            st = os.stat(perfdata.path)
+            if (st.st_dev, st.st_ino) == perfdata.ident:
+                perfdata.refresh()
+                return perfdata
+        except OSError:
+            pass
+        # File was removed or replaced (JVM exited, PID reused)
+        perfdata.close()
+        del _perfdata[pid]
+
+    path = find_perfdata_file(pid)
+    if path is None:
+        return None
+    try:
+        perfdata = PerfData(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    _perfdata[pid] = perfdata
+    return perfdata
+
+
+def prune(live_pids):
+    """Unmap files of PIDs that are no longer running."""
+    for pid in [pid for pid in _perfdata if pid not in live_pids]:
+        _perfdata.pop(pid).close()
+
+
+def _kb(counters, name: str):
+    value = counters.get(name)
+    return None if value is None else round(value / _KB, 1)
+
+
+def _seconds(counters, name: str, frequency: int):
+    value = counters.get(name)
+    return None if value is None else round(value / frequency, 3)
+
+
+def gc_columns(counters):
+    """
+    The `jstat -gc` columns ({"s0c": ..., "ygct": ...}, sizes in KB and times in
+    seconds, exactly as jstat prints them) from a counter source: an open
+    PerfData or a {name: value} dict such as jcmd PerfCounter.print output.
+    """
+    frequency = counters.get("sun.os.hrt.frequency") or 1
+    columns = {
+        "s0c":  _kb(counters, "sun.gc.generation.0.space.1.capacity"),
+        "s1c":  _kb(counters, "sun.gc.generation.0.space.2.capacity"),
+        "s0u":  _kb(counters, "sun.gc.generation.0.space.1.used"),
+        "s1u":  _kb(counters, "sun.gc.generation.0.space.2.used"),
+        "ec":   _kb(counters, "sun.gc.generation.0.space.0.capacity"),
+        "eu":   _kb(counters, "sun.gc.generation.0.space.0.used"),
+        "oc":   _kb(counters, "sun.gc.generation.1.space.0.capacity"),
+        "ou":   _kb(counters, "sun.gc.generation.1.space.0.used"),
+        "mc":   _kb(counters, "sun.gc.metaspace.capacity"),
+        "mu":   _kb(counters, "sun.gc.metaspace.used"),
+        "ccsc": _kb(counters, "sun.gc.compressedclassspace.capacity"),
+        "ccsu": _kb(counters, "sun.gc.compressedclassspace.used"),
+        "ygc":  counters.get("sun.gc.collector.0.invocations"),
+        "ygct": _seconds(counters, "sun.gc.collector.0.time", frequency),
+        "fgc":  counters.get("sun.gc.collector.1.invocations"),
+        "fgct": _seconds(counters, "sun.gc.collector.1.time", frequency),
+    }
+    # Concurrent cycles only exist on JDK 9+ collectors (G1, ZGC, Shenandoah)
+    if "sun.gc.collector.2.invocations" in counters:
+        columns["cgc"] = counters.get("sun.gc.collector.2.invocations")
+        columns["cgct"] = _seconds(counters, "sun.gc.collector.2.time", frequency)
+    times = [counters.get(f"sun.gc.collector.{i}.time") for i in range(3)]
+    columns["gct"] = round(sum(t for t in times if t) / frequency, 3)
+    return {key: float(value) for key, value in columns.items() if value is not None}
+
+
+def max_heap_size(counters):
+    """
+    Max heap size in bytes from the generation max capacities, or None. G1
+    reports the whole heap as the max of both generations, the other
+    collectors split it between them.
+    """
+    maxima = [counters.get(f"sun.gc.generation.{i}.maxCapacity") for i in range(2)]
+    maxima = [m for m in maxima if m]
+    if not maxima:
+        return None
+    if counters.get("sun.gc.policy.name", "") == "GarbageFirst":
+        return max(maxima)
+    return sum(maxima)
+
+
+def read_gc_stats(pid: int):
+    """
+    Return the `jstat -gc` columns for `pid` (see gc_columns), or None when the
+    JVM has no readable hsperfdata file.
+    """
+    perfdata = open_perfdata(pid)
+    if perfdata is None or not perfdata.accessible:
+        return None
+    try:
+        return gc_columns(perfdata)
+    except (ValueError, struct.error) as e:
+        # The mapping went away underneath us (truncated or closed file)
+        print(f"Error reading hsperfdata for PID {pid}: {e}")
+        return None
+
+
+def final_gc_stats(pid: int):
+    """
+    The last `jstat -gc` columns of a JVM that has exited, or None. Its file is
+    deleted on exit but the mapping we already hold stays readable until
+    prune() closes it, so call this first.
+    """
+    perfdata = _perfdata.get(pid)
+    if perfdata is None or perfdata.closed:
+        return None
+    try:
+        return gc_columns(perfdata)
+    except (ValueError, struct.error):
+        return None
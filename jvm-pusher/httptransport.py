@@ -0,0 +1,247 @@
+"""
+Shared HTTP transport for the sinks (Pushgateway, service discovery, InfluxDB).
+
+Connections are kept alive and pooled per host. Every attempt has bounded
+connect and read timeouts, and the whole request (retries included) has a time
+budget. Failures are retried with exponential backoff and full jitter. A
+per-host circuit breaker fails fast while a sink is down, so a dead endpoint
+costs a cycle microseconds instead of a pile of timeouts.
+"""
+import gzip
+import http.client
+import json as jsonlib
+import os
+import random
+import ssl
+import threading
+import time
+import urllib.parse
+
+# Statuses worth retrying; any other 4xx is the request's fault and fails at once
+RETRY_STATUSES = {429, 502, 503, 504}
+# Errors of a reused keep-alive connection the server had already closed
+_STALE = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class HTTPError(IOError):
+    def __init__(self, method, url, status, reason, body=b""):
+        super().__init__(f"{method} {url}: HTTP {status} {reason} {body[:200]!r}")
+        self.status = status
+        self.body = body
+
+
+class CircuitOpenError(IOError):
+    pass
+
+
+class Response:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return jsonlib.loads(self.body)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, requests
+    fail immediately; after `reset_timeout` one trial request is let through
+    (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self._trial else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+
+class Transport:
+    """Thread-safe pooled HTTP client; one instance per process is enough."""
+
+    def __init__(self, connect_timeout=2.0, read_timeout=10.0, retries=2,
+                 backoff=0.5, backoff_max=5.0, budget=15.0, pool_size=4,
+                 compress_min_bytes=1024, failure_threshold=5, reset_timeout=30.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.pool_size = pool_size
+        self.compress_min_bytes = compress_min_bytes
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._idle = {}                 # (scheme, host, port) -> [connection]
+        self._breakers = {}             # (scheme, host, port) -> CircuitBreaker
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "2")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "10")),
+            retries=int(os.getenv("HTTP_RETRIES", "2")),
+            backoff=float(os.getenv("HTTP_BACKOFF_SECONDS", "0.5")),
+            backoff_max=float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "5")),
+            budget=float(os.getenv("HTTP_REQUEST_BUDGET_SECONDS", "15")),
+            pool_size=int(os.getenv("HTTP_POOL_SIZE", "4")),
+            failure_threshold=int(os.getenv("HTTP_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "30")),
+        )
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        key = self._key(urllib.parse.urlsplit(url))
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def request(self, method: str, url: str, body=None, headers=None, json=None, compress=False) -> Response:
+        """
+        Send a request and return the Response. Raises HTTPError for an error
+        status, CircuitOpenError while the host's breaker is open, or the last
+        connection error once retries or the time budget are exhausted.
+        """
+        headers = dict(headers or {})
+        if json is not None:
+            body = jsonlib.dumps(json).encode()
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(body, str):
+            body = body.encode()
+        if compress and body and len(body) >= self.compress_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+
+        parts = urllib.parse.urlsplit(url)
+        key = self._key(parts)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{method} {url}: circuit open after {breaker.failures} failures")
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                status, reason, response_headers, data = self._send(key, method, target, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            else:
+                if status < 400:
+                    breaker.success()
+                    return Response(status, reason, response_headers, data)
+                error = HTTPError(method, url, status, reason, data)
+                if status not in RETRY_STATUSES and status < 500:
+                    # The sink is up and rejected the request: not a reason to open the breaker
+                    breaker.success()
+                    raise error
+
+            attempt += 1
+            delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+            if attempt > self.retries or time.monotonic() - started + delay > self.budget:
+                breaker.failure()
+                raise error
+            time.sleep(delay)
+
+    def _key(self, parts):
+        scheme = parts.scheme or "http"
+        return scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80)
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _send(self, key, method, target, body, headers):
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect(key)
+        try:
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                response = conn.getresponse()
+            except _STALE:
+                if not reused:
+                    raise
+                # Closed by the server while idle; this says nothing about its health
+                conn.close()
+                conn = self._connect(key)
+                conn.request(method, target, body=body, headers=headers)
+                response = conn.getresponse()
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.pool_size:
+                    idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return response.status, response.reason, response.headers, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+def prometheus_handler(transport: Transport, compress=False):
+    """`handler=` for prometheus_client's push_to_gateway() that goes through `transport`."""
+    def handler(url, method, timeout, headers, data):
+        def handle():
+            transport.request(method, url, body=data, headers=dict(headers), compress=compress)
+        return handle
+    return handler
@@ -11,7 +11,7 @@ cd ~/jvm-parser/jvm-pusher/
 #create python virtual environment and install dependencies
 python -m venv venv
 source ~/jvm-parser/jvm-pusher/venv/bin/activate
-pip install -r requirements.txt
+pip install -r requirements-all-fix.txt
 deactivate
 
 #set environments
@@ -0,0 +1,94 @@
+"""
+Collect a JVM's counters with a single `jcmd <pid> PerfCounter.print`.
+
+This is the fallback for JVMs whose PerfData is not exported as a file
+(-XX:+PerfDisableSharedMem, or a /tmp we cannot see): one jcmd run yields the
+GC columns, the max heap size and the JVM arguments that `jstat -gc`,
+`jinfo -flags` and `jinfo -sysprops` would otherwise need three JVM starts for.
+"""
+import re
+import subprocess
+import threading
+
+# Non-GC counters worth keeping from the (long) PerfCounter.print output
+_WANTED = {"sun.os.hrt.frequency", "java.rt.vmArgs", "sun.rt.javaCommand"}
+
+_ESCAPE = re.compile(r"\\(.)")
+
+
+def _parse_value(raw: bytes):
+    raw = raw.strip()
+    if raw.startswith(b'"') and raw.endswith(b'"'):
+        return raw[1:-1].decode("utf-8", "replace")
+    try:
+        return int(raw)
+    except ValueError:
+        return raw.decode("utf-8", "replace")
+
+
+def parse_perf_counters(lines):
+    """Parse PerfCounter.print output (an iterable of bytes lines) as it streams in."""
+    counters = {}
+    for line in lines:
+        name, sep, value = line.partition(b"=")
+        if not sep:
+            # "<pid>:" header
+            continue
+        name = name.decode("ascii", "replace")
+        if name.startswith("sun.gc.") or name in _WANTED:
+            counters[name] = _parse_value(value)
+    return counters
+
+
+def perf_counters(pid: int, timeout: float = None):
+    """
+    Return {counter: int|str} with the sun.gc.* counters and the few others the
+    pusher uses, parsed line by line as jcmd prints them, or None if jcmd failed.
+    Raises subprocess.TimeoutExpired if jcmd had to be killed after `timeout`.
+    """
+    cmd = ["jcmd", str(pid), "PerfCounter.print"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    killer = None
+    timed_out = threading.Event()
+    if timeout is not None:
+        def kill():
+            timed_out.set()
+            proc.kill()
+        killer = threading.Timer(timeout, kill)
+        killer.start()
+    try:
+        counters = parse_perf_counters(proc.stdout)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        if killer is not None:
+            killer.cancel()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if proc.returncode != 0 or not counters:
+        return None
+    return counters
+
+
+def system_properties(pid: int, prefix: str = "", timeout: float = None):
+    """Return {name: value} of the JVM's system properties starting with `prefix`, or None."""
+    try:
+        output = subprocess.check_output(
+            ["jcmd", str(pid), "VM.system_properties"],
+            stderr=subprocess.DEVNULL,
+            timeout=timeout
+        ).decode("utf-8", "replace")
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return parse_system_properties(output, prefix)
+
+
+def parse_system_properties(output: str, prefix: str = ""):
+    """Parse VM.system_properties output into {name: value} for names starting with `prefix`."""
+    properties = {}
+    for line in output.splitlines():
+        if line.startswith(prefix) and "=" in line:
+            name, value = line.split("=", 1)
+            # java.util.Properties escaping (\:, \=, \\ ...)
+            properties[name] = _ESCAPE.sub(r"\1", value).strip()
+    return properties
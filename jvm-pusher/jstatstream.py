@@ -0,0 +1,137 @@
+"""
+Long-lived `jstat -gc <pid> <interval>` samplers.
+
+Instead of starting jstat (and with it a JVM) for every PID on every cycle,
+one jstat child per monitored JVM keeps printing a line per interval. A reader
+thread per child parses each line into the latest-sample slot, so a cycle only
+reads memory.
+"""
+import subprocess
+import threading
+import time
+
+# A sampler that died while its JVM is still listed is restarted at most this often
+RESPAWN_BACKOFF_SECONDS = 30.0
+# A row older than this many intervals is stale (jstat stopped printing, e.g.
+# its JVM is stuck at a safepoint) and is not returned
+STALE_INTERVALS = 2
+
+
+def _parse_row(headers, line: str):
+    stats = {}
+    for key, val in zip(headers, line.split()):
+        try:
+            stats[key.lower()] = float(val)
+        except ValueError:
+            stats[key.lower()] = 0.0
+    return stats
+
+
+class JstatSampler:
+    """One `jstat -gc` child for one PID and the last row it printed."""
+
+    def __init__(self, pid: int, interval_ms: int, option: str = "-gc"):
+        self.pid = pid
+        self.interval_ms = interval_ms
+        self.started = time.monotonic()
+        # (row, time.monotonic() it was read), replaced as a whole
+        self.row = None
+        self._first = threading.Event()
+        self._proc = subprocess.Popen(
+            ["jstat", option, str(pid), str(interval_ms)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=1,
+            text=True
+        )
+        self._reader = threading.Thread(
+            target=self._read, name=f"jstat-{pid}", daemon=True
+        )
+        self._reader.start()
+
+    def _read(self):
+        headers = None
+        try:
+            for line in self._proc.stdout:
+                fields = line.split()
+                if not fields:
+                    continue
+                if headers is None or not fields[0][0].isdigit():
+                    # Header row (printed once, or again with -h)
+                    headers = fields
+                    continue
+                # Replace, never mutate: readers may hold the previous dict
+                self.row = (_parse_row(headers, line), time.monotonic())
+                self._first.set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._first.set()
+
+    @property
+    def alive(self) -> bool:
+        return self._proc.poll() is None
+
+    def latest(self, wait: float = 0.0):
+        """
+        Latest row as {column: value}; waits up to `wait` seconds for the first
+        one. None if there is none yet or it is older than STALE_INTERVALS.
+        """
+        if wait > 0 and self.row is None:
+            self._first.wait(wait)
+        row = self.row
+        if row is None:
+            return None
+        sample, sampled_at = row
+        if time.monotonic() - sampled_at > STALE_INTERVALS * self.interval_ms / 1000.0:
+            return None
+        return sample
+
+    def stop(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._proc.stdout.close()
+
+
+class SamplerManager:
+    """Starts samplers on demand and reaps them when their JVM goes away."""
+
+    def __init__(self, interval_ms: int, option: str = "-gc"):
+        self.interval_ms = interval_ms
+        self.option = option
+        self._samplers = {}
+        self._lock = threading.Lock()
+
+    def latest(self, pid: int, wait: float = 0.0):
+        """
+        Latest sample of `pid`, starting (or restarting) its sampler if needed.
+        Returns None if no fresh row is available or jstat is missing.
+        """
+        with self._lock:
+            sampler = self._samplers.get(pid)
+            if sampler is not None and not sampler.alive:
+                # jstat exited while the JVM is still listed; don't fork-loop on it
+                if time.monotonic() - sampler.started < RESPAWN_BACKOFF_SECONDS:
+                    return None
+                sampler.stop()
+                sampler = None
+            if sampler is None:
+                try:
+                    sampler = JstatSampler(pid, self.interval_ms, self.option)
+                except OSError as e:
+                    print(f"Error starting jstat sampler for PID {pid}: {e}")
+                    return None
+                self._samplers[pid] = sampler
+        return sampler.latest(wait)
+
+    def sync(self, live_pids):
+        """Stop samplers of PIDs that are no longer running."""
+        with self._lock:
+            gone = [pid for pid in self._samplers if pid not in live_pids]
+            stopped = [self._samplers.pop(pid) for pid in gone]
+        for sampler in stopped:
+            sampler.stop()
+
+    def stop_all(self):
+        self.sync(())
@@ -1,106 +1,379 @@
 import os
+import asyncio
+import math
 import subprocess
 import traceback
 import socket
 import time
 import signal
-from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+import base64
+import json
+from urllib.parse import quote
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import hsperfdata
+import httptransport
+import jvmargs
+import jcmd
+import jstatstream
+import metricstore
+import pipeline
+import procfs
+import influxsink
+import spool
+import metacache
+import jvmwatch
+import selfmetrics
+import gcrates
+import alertrules
 
 # Load configurations
 PUSHGATEWAY_URL   = os.getenv("PUSHGATEWAY_URL",   "http://pushgateway:9091")
+# Collection runs on wall-clock multiples of this interval
 PUSH_INTERVAL     = int(os.getenv("PUSH_INTERVAL_SECONDS", "15"))
 JOB_NAME          = os.getenv("JOB_NAME",          "jvm_metrics_pusher")
 INSTANCE          = os.getenv("INSTANCE",          socket.gethostname())
+# "hsperfdata" reads the JVM's PerfData file directly, "jcmd" runs one
+# `jcmd PerfCounter.print` per JVM and cycle, "jstat-stream" keeps one
+# `jstat -gc <pid> <interval>` running per JVM, "jstat" always forks jstat
+GC_PROVIDER       = os.getenv("GC_PROVIDER",       "hsperfdata")
+JSTAT_INTERVAL_MS = int(os.getenv("JSTAT_SAMPLE_INTERVAL_MS", "1000"))
+# With GC_PROVIDER=hsperfdata the GC columns can also be sampled every
+# WINDOW_SAMPLE_MS (e.g. 250) between pushes, and each push then carries their
+# min/max/mean/p95 over the interval (jvm_gc_<column>_bytes_<stat>), about five
+# times the series per JVM; 0 (the default) turns this off. Needs NumPy
+# (requirements-all-fix.txt), as does the forecast below
+WINDOW_SAMPLE_MS  = int(os.getenv("WINDOW_SAMPLE_MS", "0"))
+# Post-GC old generation occupancy over the last OOM_FORECAST_WINDOW_SECONDS is
+# fitted to a trend per JVM and extrapolated to the heap max:
+# jvm_gc_old_seconds_to_exhaustion and jvm_gc_old_leak_suspect; 0 turns this off
+OOM_FORECAST_WINDOW     = float(os.getenv("OOM_FORECAST_WINDOW_SECONDS", "1800"))
+OOM_FORECAST_MIN_POINTS = int(os.getenv("OOM_FORECAST_MIN_POINTS", "6"))
+# Local rules checked on every fresh sample of a JVM (each WINDOW_SAMPLE_MS
+# with the ring sampler, else each cycle), comma separated:
+# name:metric>threshold[/clear], metric being a `jstat -gc` column or a derived
+# metric (gc_old_occupancy_ratio, gc_time_fraction...). A rule resolves at
+# `clear`, by default ALERT_HYSTERESIS (a fraction of the threshold) past it.
+# Their state is pushed as jvm_alert_<name>; when one fires or resolves that
+# JVM is pushed at once (PUSH_MODE=pid: its group, job: a cycle is run), at most
+# once per ALERT_MIN_PUSH_INTERVAL_SECONDS. Empty (the default) turns this off;
+# for example "old_gen_full:gc_old_occupancy_ratio>0.9,gc_overhead:gc_time_fraction>0.5"
+ALERT_RULES             = os.getenv("ALERT_RULES", "")
+ALERT_HYSTERESIS        = float(os.getenv("ALERT_HYSTERESIS", "0.05"))
+ALERT_MIN_PUSH_INTERVAL = float(os.getenv("ALERT_MIN_PUSH_INTERVAL_SECONDS", "10"))
+# Rates between ring samples span at least this, so one pause is not a 100% GC time fraction
+ALERT_RATE_SECONDS      = float(os.getenv("ALERT_RATE_SECONDS", "2"))
+# "hsperfdata" lists JVMs from /tmp/hsperfdata_*, "jps" always forks jps
+DISCOVERY         = os.getenv("DISCOVERY",         "hsperfdata")
+# "inotify" collects out of band as soon as a JVM creates or deletes its
+# hsperfdata file (after WATCH_SETTLE_SECONDS, so a burst is one cycle);
+# "off" only polls every PUSH_INTERVAL_SECONDS
+WATCH             = os.getenv("WATCH",             "inotify")
+WATCH_SETTLE      = float(os.getenv("WATCH_SETTLE_SECONDS", "1"))
+# "cmdline" resolves appname/variant/-Xmx from /proc/<pid>, "jinfo" always attaches
+METADATA_SOURCE   = os.getenv("METADATA_SOURCE",   "cmdline")
+# appname/variant/heap size per process, kept across restarts (empty: memory only)
+METADATA_CACHE    = os.getenv("METADATA_CACHE_PATH", "/var/tmp/jvm-pusher/metadata.json")
+# PIDs are collected concurrently; tools still running at a deadline are killed
+COLLECT_WORKERS   = int(os.getenv("COLLECT_WORKERS", "8"))
+PID_TIMEOUT       = float(os.getenv("PID_TIMEOUT_SECONDS", "5"))
+CYCLE_TIMEOUT     = float(os.getenv("CYCLE_TIMEOUT_SECONDS", str(PUSH_INTERVAL)))
+# "threads" collects on a thread pool, "asyncio" schedules the PIDs from one
+# event loop (COLLECT_WORKERS then bounds concurrent PIDs/forks)
+RUNTIME           = os.getenv("RUNTIME",           "threads")
+# "job" PUTs everything as one job group each cycle; "pid" pushes one group per
+# JVM (instance/pid grouping key), only when its values changed, and deletes
+# groups of exited JVMs. Unchanged groups are re-PUT every PUSH_REFRESH_SECONDS
+# so their push_time_seconds does not go stale.
+PUSH_MODE         = os.getenv("PUSH_MODE",         "job")
+PUSH_REFRESH      = float(os.getenv("PUSH_REFRESH_SECONDS", "300"))
+# gzip push bodies (Pushgateway >= 1.4 accepts Content-Encoding: gzip)
+PUSH_GZIP         = os.getenv("PUSH_GZIP", "true").lower() == "true"
+# Samples waiting for the Pushgateway sink; when full the oldest is dropped.
+# The gateway only keeps the latest values, so 1 (latest wins) is enough.
+PUSH_QUEUE_SIZE   = int(os.getenv("PUSH_QUEUE_SIZE", "1"))
+# SIGUSR1 / SIGUSR2 start and then dump a cProfile / tracemalloc profile here (empty: off)
+PROFILE_DIR       = os.getenv("PROFILE_DIR", "/var/tmp/jvm-pusher/profiles")
+# How long sinks may drain their queues on shutdown
+SHUTDOWN_TIMEOUT  = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "10"))
+# Every sample is collected once and fanned out to each of these sinks:
+# pushgateway, influxdb, prometheus (pull endpoint), file
+SINKS             = [name.strip() for name in os.getenv("SINKS", "pushgateway").split(",") if name.strip()]
+# influxdb sink (same settings as jvm-pusher-influxdb.py)
+INFLUXDB_URL            = os.getenv("INFLUXDB_URL",      "http://localhost:8086")
+INFLUXDB_TOKEN          = os.getenv("INFLUXDB_TOKEN",    "")
+INFLUXDB_DATABASE       = os.getenv("INFLUXDB_DATABASE", "jvm-metrics")
+INFLUXDB_GZIP           = os.getenv("INFLUXDB_GZIP",     "true").lower() == "true"
+INFLUXDB_BATCH_SIZE     = int(os.getenv("INFLUXDB_BATCH_SIZE",     "5000"))
+INFLUXDB_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_FLUSH_INTERVAL_SECONDS", "10"))
+INFLUXDB_MAX_BACKLOG    = int(os.getenv("INFLUXDB_MAX_BACKLOG",    "100000"))
+INFLUXDB_GC_LAYOUT      = os.getenv("INFLUXDB_GC_LAYOUT", "measurements")
+INFLUXDB_QUEUE_SIZE     = int(os.getenv("INFLUXDB_QUEUE_SIZE",     "10"))
+SPOOL_DIR               = os.getenv("SPOOL_DIR", "/var/tmp/jvm-pusher/spool")
+SPOOL_MAX_BYTES         = int(os.getenv("SPOOL_MAX_BYTES", str(256 * 1024 * 1024)))
+SPOOL_SEGMENT_BYTES     = int(os.getenv("SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+SPOOL_REPLAY_RATE       = int(os.getenv("SPOOL_REPLAY_BYTES_PER_SECOND", str(1024 * 1024)))
+# prometheus sink: /metrics served for scraping
+METRICS_ADDR            = os.getenv("METRICS_ADDR", "")
+METRICS_PORT            = int(os.getenv("METRICS_PORT", "9100"))
+# file sink: one JSON line per JVM and sample, rotated to <path>.1 at the size cap
+FILE_SINK_PATH          = os.getenv("FILE_SINK_PATH", "/var/tmp/jvm-pusher/samples.jsonl")
+FILE_SINK_MAX_BYTES     = int(os.getenv("FILE_SINK_MAX_BYTES", str(64 * 1024 * 1024)))
+FILE_QUEUE_SIZE         = int(os.getenv("FILE_QUEUE_SIZE", "10"))
 
 shutdown_flag = False
+_stop = threading.Event()
 
-# Cache for sysprops and heap size (cleared each cycle to avoid stale data)
-_sysprops_cache = {}
-_heap_cache = {}
+# Sysprops and heap size per process: keyed by (pid, start time) so PID reuse
+# is detected, persisted so a restart does not attach to every JVM again
+_metadata = metacache.MetadataCache(METADATA_CACHE)
+# jcmd PerfCounter.print output, collected once per PID and cycle
+_perfcounters_cache = {}
+# Long-lived jstat samplers (GC_PROVIDER=jstat-stream)
+_samplers = jstatstream.SamplerManager(JSTAT_INTERVAL_MS)
+# JVM start/exit events (WATCH=inotify) set _wake for an out-of-band cycle
+_wake = threading.Event()
+_wake_timer = None
+_watcher = None
+# PIDs seen starting but not collected yet -> when they were seen
+_starting = {}
+_lifecycle_lock = threading.Lock()
+# Previous cycle's samples, so JVMs that exited since get one final sample
+_last_collected = {}
+# High-frequency GC windows (WINDOW_SAMPLE_MS), started in main
+_windows = None
+_window_sampler = None
+# Previous GC sample per (pid, start time), for rates between cycles
+_rates = gcrates.RateTracker()
+# Post-GC old generation windows (OOM_FORECAST_WINDOW_SECONDS), created in main
+_forecaster = None
+DERIVED_METRICS = dict(gcrates.METRICS)
+# ALERT_RULES, created in main; the alerts sink pushes out of band
+_rules = None
+_sample_rates = gcrates.RateTracker(ALERT_RATE_SECONDS, identity=lambda pid: None)
+_alert_worker = None
+# PUSH_MODE=pid: groups pushed by an alert since, replaced whole by the next cycle
+_alerted = set()
+_alert_lock = threading.Lock()
+
+def newStore():
+    store = metricstore.MetricStore(["pid", "appname", "variant"], {"instance": INSTANCE})
+    store.declare("jvm_heap_size_bytes", "Max heap size in bytes.")
+    return store
+
+# Series live across cycles; only changed values are re-serialized.
+# Each sink that renders owns a store and is the only thread updating it.
+_store = newStore()
+_pull_store = None
+# PUSH_MODE=pid: what the Pushgateway acknowledged per group,
+# {pid: {"labels": ..., "values": {metric: value}, "at": monotonic}}
+_acked = {}
+# Pooled keep-alive connections with timeouts, retries and a circuit breaker
+_http = httptransport.Transport.from_env()
+
+# Deadline (time.monotonic()) of the PID the current worker thread collects
+_deadline = threading.local()
+_executor = ThreadPoolExecutor(max_workers=COLLECT_WORKERS, thread_name_prefix="collect")
+
+def toolTimeout():
+    deadline = getattr(_deadline, "value", None)
+    if deadline is None:
+        return CYCLE_TIMEOUT
+    return max(deadline - time.monotonic(), 0.001)
+
+def runTool(cmd):
+    """Run a JDK tool and return its stdout; raises TimeoutExpired (after killing it) at the deadline."""
+    with selfmetrics.tool_run(cmd[0]):
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=toolTimeout(),
+            check=True
+        )
+    return result.stdout.decode()
+
+# Set when PROFILE_DIR is; work to be profiled goes through profiled()
+_profiler = None
+
+def profiled(fn, *args):
+    if _profiler is None:
+        return fn(*args)
+    return _profiler.call(fn, *args)
 
 def getSysprops(pid: int):
-    # Check if PID still exists before using cache
-    if pid not in _sysprops_cache:
+    sysprops = _metadata.get(pid, "sysprops")
+    if sysprops is None:
+        if METADATA_SOURCE == "cmdline":
+            sysprops = getSyspropsCmdline(pid)
+        if sysprops is None and GC_PROVIDER == "jcmd":
+            sysprops = getSyspropsJcmd(pid)
+        # Properties not on the command line (e.g. set by the application)
+        if sysprops is None:
+            sysprops = getSyspropsJinfo(pid)
+        if sysprops is None:
+            # jinfo failed, maybe only this time: not cached, asked again next cycle
+            return {"appname": "unknown", "variant": "unknown"}
+        _metadata.put(pid, "sysprops", sysprops)
+    return sysprops
+
+def getSyspropsCmdline(pid: int):
+    try:
+        options = jvmargs.jvm_options(pid)
+    except Exception as e:
+        print(f"Error reading command line of PID {pid}: {e}")
+        return None
+    if options is None:
+        return None
+    return parseSysprops(jvmargs.system_property(options, "com.netfolio.appname"),
+                         jvmargs.system_property(options, "com.netfolio.fullname"))
+
+def parseSysprops(appname, variant):
+    if appname is None or variant is None:
+        return None
+    return {"appname": appname.strip(), "variant": variant.strip()}
+
+def syspropsFromCounters(counters):
+    options = jvmargs.split_vm_args(counters.get("java.rt.vmArgs", ""))
+    return (jvmargs.system_property(options, "com.netfolio.appname"),
+            jvmargs.system_property(options, "com.netfolio.fullname"))
+
+def getSyspropsJcmd(pid: int):
+    appname, variant = syspropsFromCounters(getPerfCounters(pid) or {})
+    if appname is None or variant is None:
+        # Only runs on first sight, the result is cached per PID
         try:
-            # Use list-based subprocess call instead of shell=True for security
-            jinfo_proc = subprocess.Popen(
-                ["jinfo", "-sysprops", str(pid)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL
-            )
-            grep_proc = subprocess.Popen(
-                ["grep", "-E", r"com\.netfolio\.(appname|fullname)="],
-                stdin=jinfo_proc.stdout,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL
-            )
-            jinfo_proc.stdout.close()
-            output, _ = grep_proc.communicate()
-            
-            appname = variant = "unknown"
-            for line in output.decode().splitlines():
-                if "com.netfolio.appname" in line:
-                    appname = line.split("=", 1)[1].strip()
-                elif "com.netfolio.fullname" in line:
-                    variant = line.split("=", 1)[1].strip()
-            _sysprops_cache[pid] = {"appname": appname, "variant": variant}
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            _sysprops_cache[pid] = {"appname": "unknown", "variant": "unknown"}
+            with selfmetrics.tool_run("jcmd"):
+                properties = jcmd.system_properties(pid, "com.netfolio.", timeout=toolTimeout()) or {}
+        except subprocess.TimeoutExpired:
+            raise
         except Exception as e:
-            print(f"Error getting sysprops for PID {pid}: {e}")
-            _sysprops_cache[pid] = {"appname": "unknown", "variant": "unknown"}
-    return _sysprops_cache.get(pid, {"appname": "unknown", "variant": "unknown"})
+            print(f"Error getting system properties for PID {pid}: {e}")
+            properties = {}
+        appname = properties.get("com.netfolio.appname", appname)
+        variant = properties.get("com.netfolio.fullname", variant)
+    return parseSysprops(appname, variant)
+
+def getSyspropsJinfo(pid: int):
+    try:
+        # Use list-based subprocess call instead of shell=True for security
+        return parseJinfoSysprops(runTool(["jinfo", "-sysprops", str(pid)]))
+    except subprocess.TimeoutExpired:
+        # Not cached, the PID is retried next cycle
+        raise
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    except Exception as e:
+        print(f"Error getting sysprops for PID {pid}: {e}")
+        return None
+
+def parseJinfoSysprops(output: str):
+    appname = variant = "unknown"
+    for line in output.splitlines():
+        if line.startswith("com.netfolio.appname="):
+            appname = line.split("=", 1)[1].strip()
+        elif line.startswith("com.netfolio.fullname="):
+            variant = line.split("=", 1)[1].strip()
+    return {"appname": appname, "variant": variant}
 
 def getHeapSize(pid: int):
-    # Check if PID still exists before using cache
-    if pid not in _heap_cache:
+    heap = _metadata.get(pid, "heap")
+    if heap is None:
+        size = None
+        if METADATA_SOURCE == "cmdline":
+            size = getHeapSizeCmdline(pid)
+        if size is None and GC_PROVIDER == "jcmd":
+            size = getHeapSizeJcmd(pid)
+        # No explicit -Xmx: the JVM picked an ergonomic default, ask it
+        if size is None:
+            size = getHeapSizeJinfo(pid)
+        if size is None:
+            # jinfo failed: not cached, asked again next cycle
+            return {"max_heap_size": 0}
+        heap = {"max_heap_size": size}
+        _metadata.put(pid, "heap", heap)
+    return heap
+
+def getHeapSizeCmdline(pid: int):
+    try:
+        options = jvmargs.jvm_options(pid)
+    except Exception as e:
+        print(f"Error reading command line of PID {pid}: {e}")
+        return None
+    if options is None:
+        return None
+    return jvmargs.max_heap_size(options)
+
+def getHeapSizeJcmd(pid: int):
+    counters = getPerfCounters(pid)
+    if counters is None:
+        return None
+    return heapSizeFromCounters(counters)
+
+def heapSizeFromCounters(counters):
+    options = jvmargs.split_vm_args(counters.get("java.rt.vmArgs", ""))
+    return jvmargs.max_heap_size(options) or hsperfdata.max_heap_size(counters)
+
+def getHeapSizeJinfo(pid: int):
+    try:
+        # Use list-based subprocess call instead of shell=True for security
+        return parseJinfoHeapSize(runTool(["jinfo", "-flags", str(pid)]))
+    except subprocess.TimeoutExpired:
+        raise
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    except Exception as e:
+        print(f"Error getting heap size for PID {pid}: {e}")
+        return None
+
+def parseJinfoHeapSize(output: str):
+    size = 0
+    for flag in output.split():
+        if flag.startswith("-XX:MaxHeapSize="):
+            size = jvmargs.parse_size(flag.split("=", 1)[1]) or size
+    return size
+
+def getPerfCounters(pid: int):
+    if pid not in _perfcounters_cache:
         try:
-            # Use list-based subprocess call instead of shell=True for security
-            jinfo_proc = subprocess.Popen(
-                ["jinfo", "-flags", str(pid)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL
-            )
-            grep_proc = subprocess.Popen(
-                ["grep", "-o", r"XX:MaxHeapSize=[0-9]*"],
-                stdin=jinfo_proc.stdout,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL
-            )
-            jinfo_proc.stdout.close()
-            output, _ = grep_proc.communicate()
-            
-            size = 0
-            for line in output.decode().splitlines():
-                if line.startswith("XX:MaxHeapSize="):
-                    size = int(line.split("=", 1)[1])
-            _heap_cache[pid] = {"max_heap_size": size}
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            _heap_cache[pid] = {"max_heap_size": 0}
+            with selfmetrics.tool_run("jcmd"):
+                _perfcounters_cache[pid] = jcmd.perf_counters(pid, timeout=toolTimeout())
+        except subprocess.TimeoutExpired:
+            raise
+        except FileNotFoundError:
+            _perfcounters_cache[pid] = None
         except Exception as e:
-            print(f"Error getting heap size for PID {pid}: {e}")
-            _heap_cache[pid] = {"max_heap_size": 0}
-    return _heap_cache.get(pid, {"max_heap_size": 0})
+            print(f"Error getting perf counters for PID {pid}: {e}")
+            _perfcounters_cache[pid] = None
+    return _perfcounters_cache[pid]
 
 def getGCData(pid: int):
+    if GC_PROVIDER == "hsperfdata":
+        stats = hsperfdata.read_gc_stats(pid)
+        if stats is not None:
+            return stats
+    elif GC_PROVIDER == "jcmd":
+        counters = getPerfCounters(pid)
+        if counters is not None:
+            return hsperfdata.gc_columns(counters)
+    elif GC_PROVIDER == "jstat-stream":
+        # A new sampler prints its first row after about a jstat start; a stale
+        # row (jstat stopped printing) is None too and read once below instead
+        stats = _samplers.latest(pid, wait=toolTimeout())
+        if stats is not None:
+            return stats
+    # Provider has nothing for this JVM (no hsperfdata file, jcmd failed...)
+    return getGCDataJstat(pid)
+
+def getGCDataJstat(pid: int):
     try:
         # Use list-based subprocess call instead of shell=True for security
-        raw = subprocess.check_output(
-            ["jstat", "-gc", str(pid)],
-            stderr=subprocess.DEVNULL
-        ).decode()
-        lines = raw.strip().splitlines()
-        if len(lines) < 2:
-            return {}
-        headers = lines[0].split()
-        values  = lines[1].split()
-        stats = {}
-        for key, val in zip(headers, values):
-            try:
-                stats[key.lower()] = float(val)
-            except ValueError:
-                stats[key.lower()] = 0.0
-        return stats
+        return parseJstat(runTool(["jstat", "-gc", str(pid)]))
+    except subprocess.TimeoutExpired:
+        raise
     except (subprocess.CalledProcessError, FileNotFoundError):
         return {}
     except Exception as e:
@@ -108,108 +381,623 @@ def getGCData(pid: int):
         traceback.print_exc()
         return {}
 
+def parseJstat(raw: str):
+    lines = raw.strip().splitlines()
+    if len(lines) < 2:
+        return {}
+    headers = lines[0].split()
+    values  = lines[1].split()
+    stats = {}
+    for key, val in zip(headers, values):
+        try:
+            stats[key.lower()] = float(val)
+        except ValueError:
+            stats[key.lower()] = 0.0
+    return stats
+
+# Main classes of the JDK tools (also JVMs) the pusher runs: never monitored
+JDK_TOOLS = {"Jps", "JCmd", "Jstat", "JInfo", "JMap", "JStack"}
+
 def getPIDs():
-    pids = {}
+    pids = scanPIDs()
+    if pids is not None:
+        return pids
+    # No hsperfdata directory to scan (e.g. JVMs in another mount namespace)
+    return getPIDsJps()
+
+def scanPIDs():
+    if DISCOVERY != "hsperfdata":
+        return None
+    try:
+        pids = hsperfdata.list_jvms()
+    except Exception as e:
+        print(f"Error scanning hsperfdata directories: {e}")
+        return None
+    if pids is None:
+        return None
+    return {pid: name for pid, name in pids.items() if name not in JDK_TOOLS}
+
+def getPIDsJps():
     try:
         # Use list-based subprocess call instead of shell=True for security
-        raw = subprocess.check_output(["jps"], stderr=subprocess.DEVNULL).decode()
-        for line in raw.strip().splitlines():
-            parts = line.split()
-            if len(parts) == 2 and parts[1] != "Jps":
-                pid, name = parts
-                pids[int(pid)] = name
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        return parseJps(runTool(["jps"]))
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
         print(f"Error retrieving PIDs: {e}")
     except Exception as e:
         print(f"Unexpected error retrieving PIDs: {e}")
+    return {}
+
+def parseJps(raw: str):
+    pids = {}
+    for line in raw.strip().splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] not in JDK_TOOLS:
+            pid, name = parts
+            pids[int(pid)] = name
     return pids
 
-def push_metrics():
-    # Clear caches at the start of each cycle to avoid stale data
-    global _sysprops_cache, _heap_cache
-    current_pids = getPIDs()
-    
-    # Remove entries for PIDs that no longer exist
-    _sysprops_cache = {pid: _sysprops_cache[pid] for pid in current_pids if pid in _sysprops_cache}
-    _heap_cache = {pid: _heap_cache[pid] for pid in current_pids if pid in _heap_cache}
-    
-    pids = current_pids
-    all_gc_keys = set()
-    collected    = {}
+def collectPID(pid: int, cycle_deadline: float):
+    # Every tool run for this PID is killed once its deadline has passed
+    _deadline.value = min(time.monotonic() + PID_TIMEOUT, cycle_deadline)
+    try:
+        sysprops = getSysprops(pid)
+        appname = sysprops.get("appname", "unknown")
+        variant = sysprops.get("variant", "unknown")
+        
+        # Skip PIDs with unknown appname or variant
+        if appname == "unknown" or variant == "unknown":
+            print(f"Skipping PID {pid}: appname={appname}, variant={variant} (unknown values)")
+            selfmetrics.PIDS_SKIPPED.labels("unknown").inc()
+            return None
+        
+        heap     = getHeapSize(pid)
+        gc       = getGCData(pid)
+        return {"sysprops": sysprops, "heap": heap, "gc": gc, "time": time.time_ns()}
+    finally:
+        _deadline.value = None
 
-    # collect per-PID data & discover all keys
-    for pid in pids:
-        try:
-            sysprops = getSysprops(pid)
-            appname = sysprops.get("appname", "unknown")
-            variant = sysprops.get("variant", "unknown")
-            
-            # Skip PIDs with unknown appname or variant
-            if appname == "unknown" or variant == "unknown":
-                print(f"Skipping PID {pid}: appname={appname}, variant={variant} (unknown values)")
-                continue
-            
-            heap     = getHeapSize(pid)
-            gc       = getGCData(pid)
+def collectAll(pids):
+    """Collect all PIDs concurrently; PIDs that miss their deadline are reported and skipped."""
+    cycle_deadline = time.monotonic() + CYCLE_TIMEOUT
+    futures = {_executor.submit(profiled, collectPID, pid, cycle_deadline): pid for pid in pids}
+    done, late = wait(futures, timeout=CYCLE_TIMEOUT)
 
-            all_gc_keys |= set(gc.keys())
-            collected[pid] = {"sysprops": sysprops, "heap": heap, "gc": gc}
+    collected = {}
+    for future in done:
+        pid = futures[future]
+        try:
+            stats = future.result()
+        except subprocess.TimeoutExpired as e:
+            print(f"Skipping PID {pid}: {e.cmd[0]} did not finish in time and was killed")
+            selfmetrics.PIDS_SKIPPED.labels("timeout").inc()
+            continue
         except Exception as e:
             # Skip this PID if there's an error, but continue with others
             print(f"Error collecting metrics for PID {pid}: {e}")
+            selfmetrics.PIDS_SKIPPED.labels("error").inc()
             continue
+        if stats is not None:
+            collected[pid] = stats
+    for future in late:
+        # Queued ones never start; running ones are killed by their own deadline
+        future.cancel()
+        print(f"Skipping PID {futures[future]}: not collected within the {CYCLE_TIMEOUT}s cycle deadline")
+        selfmetrics.PIDS_SKIPPED.labels("deadline").inc()
+    return collected
 
-    # create registry & base gauges
-    registry = CollectorRegistry()
-
-    heap_gauge = Gauge(
-        "jvm_heap_size_bytes",
-        "Max heap size in bytes.",
-        ["pid", "appname", "variant", "instance"],
-        registry=registry
-    )
+def pruneCaches(current_pids):
+    # Clear caches at the start of each cycle to avoid stale data
+    global _perfcounters_cache
+    
+    # Remove entries for processes that no longer exist (or whose PID was reused)
+    _metadata.prune(current_pids)
+    _metadata.save()
+    hsperfdata.prune(current_pids)
+    _perfcounters_cache = {}
+    _samplers.sync(current_pids)
+    if _window_sampler is not None:
+        _window_sampler.sync(current_pids)
+    if _rules is not None:
+        # Every live JVM, collected or not: a firing rule forgotten while it runs would fire again
+        _rules.sync(current_pids)
+        _sample_rates.retain(current_pids)
 
-    gc_gauges = {}
+def updateStore(collected, store=None):
+    """Apply one cycle's samples to the store and drop PIDs that were not collected."""
+    store = _store if store is None else store
+    all_gc_keys = set()
+    for stats in collected.values():
+        all_gc_keys |= set(stats["gc"].keys())
     for key in sorted(all_gc_keys):
-        metric_name = f"jvm_gc_{key}_bytes"
-        description = f"GC metric for {key}."
-        gc_gauges[key] = Gauge(
-            metric_name,
-            description,
-            ["pid", "appname", "variant", "instance"],
-            registry=registry
-        )
+        store.declare(f"jvm_gc_{key}_bytes", f"GC metric for {key}.")
+        if _windows is not None:
+            for stat in ringbuffer.STATS:
+                store.declare(f"jvm_gc_{key}_bytes_{stat}", f"{stat} of {key} over the push interval.")
 
-    # set gauge values
     for pid, stats in collected.items():
-        pid_str  = str(pid)
-        appname  = stats["sysprops"].get("appname",  "unknown")
-        variant  = stats["sysprops"].get("variant",  "unknown")
-
-        heap_gauge.labels(
-            pid=pid_str,
-            appname=appname,
-            variant=variant,
-            instance=INSTANCE
-        ).set(stats["heap"].get("max_heap_size", 0))
-
-        for key, gauge in gc_gauges.items():
-            gauge.labels(
-                pid=pid_str,
-                appname=appname,
-                variant=variant,
-                instance=INSTANCE
-            ).set(stats["gc"].get(key, 0.0))
+        values = {"jvm_heap_size_bytes": stats["heap"].get("max_heap_size", 0)}
+        for key in all_gc_keys:
+            values[f"jvm_gc_{key}_bytes"] = stats["gc"].get(key, 0.0)
+        for key, value in stats.get("derived", {}).items():
+            store.declare(f"jvm_{key}", DERIVED_METRICS[key])
+            values[f"jvm_{key}"] = value
+        for name, firing in stats.get("alerts", {}).items():
+            store.declare(f"jvm_alert_{name}", f"1 while {_rules.rules[name]} (alert rule {name}).")
+            values[f"jvm_alert_{name}"] = firing
+        window = stats.get("gc_window")
+        if window is not None:
+            for stat in ringbuffer.STATS:
+                for key, value in window[stat].items():
+                    if key in all_gc_keys:
+                        values[f"jvm_gc_{key}_bytes_{stat}"] = value
+        store.update(
+            str(pid),
+            (str(pid), stats["sysprops"].get("appname", "unknown"), stats["sysprops"].get("variant", "unknown")),
+            values
+        )
+    store.retain({str(pid) for pid in collected})
+    return store.render()
+
+def groupingPath(job: str, grouping_key=None):
+    """Pushgateway URL path for a group; values containing '/' are base64 encoded."""
+    def part(name, value):
+        value = str(value)
+        if "/" in value:
+            return f"{name}@base64/{base64.urlsafe_b64encode(value.encode()).decode()}"
+        return f"{name}/{quote(value, safe='')}" if value else f"{name}@base64/="
+    parts = [part("job", job)] + [part(k, v) for k, v in (grouping_key or {}).items()]
+    return "/metrics/" + "/".join(parts)
+
+def gatewayURL(path: str):
+    url = PUSHGATEWAY_URL if "://" in PUSHGATEWAY_URL else f"http://{PUSHGATEWAY_URL}"
+    return url.rstrip("/") + path
 
+def pushExposition(data: bytes, method="PUT", grouping_key=None):
+    _http.request(
+        method,
+        gatewayURL(groupingPath(JOB_NAME, grouping_key)),
+        body=data,
+        headers={"Content-Type": CONTENT_TYPE_LATEST},
+        compress=PUSH_GZIP
+    )
+
+def pushStore(data: bytes):
     try:
-        push_to_gateway(PUSHGATEWAY_URL, job=JOB_NAME, registry=registry)
+        # PUT replaces the whole job group, like push_to_gateway
+        pushExposition(data)
         print(f"Metrics pushed to {PUSHGATEWAY_URL} for job='{JOB_NAME}'")
     except Exception as e:
         print(f"Failed to push metrics: {e}")
+        selfmetrics.SINK_ERRORS.labels("pushgateway").inc()
+
+def groupingKey(pid: str):
+    return {"instance": INSTANCE, "pid": pid}
+
+def pushGroups():
+    """PUSH_MODE=pid: push changed JVM groups and delete the groups of exited JVMs."""
+    global _alerted
+    now = time.monotonic()
+    current = set(_store.pids())
+    pushed = deleted = 0
+    with _alert_lock:
+        alerted, _alerted = _alerted, set()
+
+    for pid in [pid for pid in _acked if pid not in current]:
+        try:
+            pushExposition(b"", method="DELETE", grouping_key=groupingKey(pid))
+            del _acked[pid]
+            deleted += 1
+        except Exception as e:
+            # Kept in _acked, so the delete is retried next cycle
+            print(f"Failed to delete group of PID {pid}: {e}")
+            selfmetrics.SINK_ERRORS.labels("pushgateway").inc()
+
+    for pid in current:
+        values = _store.values(pid)
+        labels = _store.label_values(pid)
+        acked = _acked.get(pid)
+        if (acked is None or acked["labels"] != labels or acked["values"].keys() != values.keys()
+                or now - acked["at"] >= PUSH_REFRESH or pid in alerted):
+            # New group, different metric set, refresh due or changed by an alert: replace the whole group
+            method, metrics = "PUT", None
+        else:
+            # Same metrics: POST replaces just the families that changed
+            metrics = {m for m, v in values.items() if acked["values"][m] != v}
+            if not metrics:
+                continue
+            method = "POST"
+        try:
+            pushExposition(_store.render_pid(pid, metrics), method=method, grouping_key=groupingKey(pid))
+        except Exception as e:
+            # Not acknowledged: the group is still considered changed next cycle
+            print(f"Failed to push metrics of PID {pid}: {e}")
+            selfmetrics.SINK_ERRORS.labels("pushgateway").inc()
+            continue
+        _acked[pid] = {"labels": labels, "values": values, "at": now}
+        pushed += 1
+
+    print(f"Pushed {pushed} changed and deleted {deleted} JVM groups to {PUSHGATEWAY_URL} for job='{JOB_NAME}'")
+
+def adoptGroups():
+    """
+    PUSH_MODE=pid: take over the JVM groups this instance pushed before a
+    restart. The Pushgateway never expires groups, so those of JVMs that
+    exited meanwhile are deleted by the first pushGroups(); the others are
+    replaced whole.
+    """
+    try:
+        groups = _http.request("GET", gatewayURL("/api/v1/metrics")).json().get("data", [])
+    except Exception as e:
+        print(f"Could not list the Pushgateway's groups, groups of JVMs that exited while stopped may remain: {e}")
+        return
+    adopted = 0
+    for group in groups:
+        labels = group.get("labels", {})
+        if (labels.keys() == {"job", "instance", "pid"} and labels["job"] == JOB_NAME
+                and labels["instance"] == INSTANCE and labels["pid"] not in _acked):
+            _acked[labels["pid"]] = {"labels": None, "values": {}, "at": float("-inf")}
+            adopted += 1
+    if adopted:
+        print(f"Adopted {adopted} JVM groups pushed before this start")
+
+def pushCycle(data: bytes):
+    if PUSH_MODE == "pid":
+        pushGroups()
+    else:
+        pushStore(data)
+
+def finalSamples(current_pids):
+    """
+    One last sample of every JVM that exited since the previous cycle, read
+    from its still mapped hsperfdata file before pruneCaches() unmaps it.
+    """
+    final = {}
+    for pid, stats in _last_collected.items():
+        if pid not in current_pids:
+            gc = hsperfdata.final_gc_stats(pid)
+            if gc:
+                final[pid] = {"sysprops": stats["sysprops"], "heap": stats["heap"], "gc": gc, "time": time.time_ns()}
+    return final
+
+def finishCycle(collected, final, current_pids):
+    global _last_collected
+    if _windows is not None:
+        for pid, window in _windows.drain().items():
+            if pid in collected:
+                collected[pid]["gc_window"] = window
+    for pid, stats in [*collected.items(), *final.items()]:
+        if stats["gc"]:
+            stats["derived"] = _rates.update(pid, stats["gc"], stats["time"])
+    # Every live JVM: one that missed this cycle keeps measuring from its previous sample
+    _rates.retain(current_pids)
+    if _forecaster is not None:
+        forecastOldGen(collected, current_pids)
+    if _rules is not None:
+        # This cycle's push carries the rule states. With the alerts sink the
+        # ring sampler alone checks the rules, else they are checked here
+        for pid, stats in collected.items():
+            if _alert_worker is None:
+                _rules.evaluate(pid, {**stats["gc"], **stats.get("derived", {})})
+            stats["alerts"] = _rules.states(pid)
+    _last_collected = collected
+    retryStarting(collected)
+    # Exited JVMs are in this sample once; the next one drops (or deletes) them
+    return {**collected, **final}
+
+def forecastOldGen(collected, current_pids):
+    """Adds the time-to-exhaustion forecast to the derived metrics of each collected JVM."""
+    limits = {}
+    for pid, stats in collected.items():
+        if stats["gc"]:
+            _forecaster.observe(pid, stats["time"], stats["gc"])
+            limits[pid] = oomforecast.old_gen_limit(stats["heap"].get("max_heap_size", 0), stats["gc"])
+    # Every live JVM: one slow cycle must not throw away a window of history
+    _forecaster.retain(current_pids)
+    for pid, forecast in _forecaster.forecast(limits, time.time()).items():
+        collected[pid]["derived"].update(forecast)
+
+def collectCycle():
+    with selfmetrics.phase("discover"):
+        current_pids = getPIDs()
+    with selfmetrics.phase("prune"):
+        final = finalSamples(current_pids)
+        pruneCaches(current_pids)
+    with selfmetrics.phase("collect"):
+        collected = collectAll(current_pids)
+    return finishCycle(collected, final, current_pids)
+
+def wakeSoon():
+    """Run an out-of-band cycle WATCH_SETTLE seconds after the first of a burst of JVM events."""
+    global _wake_timer
+    with _lifecycle_lock:
+        if _wake_timer is not None and _wake_timer.is_alive():
+            return
+        _wake_timer = threading.Timer(WATCH_SETTLE, _wake.set)
+        _wake_timer.daemon = True
+        _wake_timer.start()
+
+def isJDKTool(pid: int):
+    """
+    Whether a JVM that just started is a JDK tool: forked by the pusher itself,
+    or run by someone else. Its hsperfdata file has no main class yet, so go
+    by the parent and the executable.
+    """
+    if procfs.parent_pid(pid) == os.getpid():
+        return True
+    argv = procfs.cmdline(pid)
+    return bool(argv) and os.path.basename(argv[0]) in {tool.lower() for tool in JDK_TOOLS}
+
+def onJVMEvent(event, pid):
+    """Called by the watcher thread."""
+    if event == jvmwatch.START and isJDKTool(pid):
+        return
+    with _lifecycle_lock:
+        if event == jvmwatch.START:
+            _starting.setdefault(pid, time.monotonic())
+        elif event == jvmwatch.STOP:
+            if _starting.pop(pid, None) is None and pid not in _last_collected:
+                # Not a JVM we collect (a tool, an unknown appname...): nothing to push
+                return
+    wakeSoon()
+
+def retryStarting(collected):
+    """A new JVM whose counters were not ready yet gets another early cycle (up to PUSH_INTERVAL)."""
+    with _lifecycle_lock:
+        now = time.monotonic()
+        for pid in [pid for pid, seen in _starting.items() if pid in collected or now - seen > PUSH_INTERVAL]:
+            del _starting[pid]
+        pending = bool(_starting)
+    if pending:
+        wakeSoon()
+
+def onFreshSample(pid, gc, time_ns):
+    """Ring sampler callback: checks the rules and queues an out-of-band push when one changed."""
+    values = {**gc, **_sample_rates.update(pid, gc, time_ns)}
+    changed = _rules.evaluate(pid, values)
+    # Only JVMs the cycles push: for any other the push (or woken cycle) would carry nothing,
+    # and one not collected yet gets its rule states with the next cycle anyway
+    if pid in _last_collected and _rules.take_push(pid, changed):
+        _alert_worker.offer({"pid": pid, "values": values, "states": _rules.states(pid)})
+
+def metricFamily(key):
+    """Name and help of the family a GC column or derived metric is pushed as."""
+    if key in DERIVED_METRICS:
+        return f"jvm_{key}", DERIVED_METRICS[key]
+    return f"jvm_gc_{key}_bytes", f"GC metric for {key}."
+
+def pushAlert(alert):
+    """Alerts sink: pushes a JVM whose rule fired or resolved right away."""
+    pid = alert["pid"]
+    if PUSH_MODE != "pid":
+        # The job group is only ever replaced whole: collect and push it now
+        _wake.set()
+        return
+    stats = _last_collected.get(pid)
+    if stats is None:
+        # Never collected yet, so no labels: the next cycle pushes it
+        return
+    store = metricstore.MetricStore(["pid", "appname", "variant"], {"instance": INSTANCE})
+    values = {}
+    for name, firing in alert["states"].items():
+        rule = _rules.rules[name]
+        store.declare(f"jvm_alert_{name}", f"1 while {rule} (alert rule {name}).")
+        values[f"jvm_alert_{name}"] = firing
+        if rule.metric in alert["values"]:
+            metric, help_text = metricFamily(rule.metric)
+            store.declare(metric, help_text)
+            values[metric] = alert["values"][rule.metric]
+    store.update(str(pid), (str(pid), stats["sysprops"].get("appname", "unknown"), stats["sysprops"].get("variant", "unknown")), values)
+    # POST: only these families are replaced, the rest of the group stays
+    pushExposition(store.render_pid(str(pid)), method="POST", grouping_key=groupingKey(str(pid)))
+    with _alert_lock:
+        _alerted.add(str(pid))
+    firing = [name for name, state in alert["states"].items() if state]
+    print(f"Pushed alert state of PID {pid} to {PUSHGATEWAY_URL}, firing: {', '.join(firing) or 'none'}")
+
+def pushSample(sample):
+    """Pushgateway sink: runs on its own thread, the store is only touched here."""
+    with selfmetrics.phase("store"):
+        data = updateStore(sample.collected)
+    with selfmetrics.phase("push"):
+        pushCycle(data)
+    pushSelfMetrics()
+
+def pushSelfMetrics():
+    """The collector's own metrics go to an instance group that neither push mode replaces."""
+    try:
+        pushExposition(selfmetrics.render(), grouping_key={"instance": INSTANCE})
+    except Exception as e:
+        print(f"Failed to push collector metrics: {e}")
+
+# Other sinks. Created only when listed in SINKS.
+
+_influx_writer = None
+_influx_encoder = None
+_metrics_server = None
+
+def openSpool():
+    if not SPOOL_DIR:
+        return None
+    try:
+        return spool.Spool(SPOOL_DIR, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES)
+    except OSError as e:
+        print(f"Spool disabled, cannot use {SPOOL_DIR}: {e}")
+        return None
+
+def writeInfluxSample(sample):
+    """InfluxDB sink: encodes and queues for the background writer, never waits on the network."""
+    _influx_encoder.retain(sample.collected)
+    _influx_writer.write(_influx_encoder.encode(sample.collected))
+
+def serveSample(sample):
+    """Prometheus sink: the pull endpoint serves whatever the last sample left in _pull_store."""
+    updateStore(sample.collected, _pull_store)
+
+def writeFileSample(sample):
+    """File sink: one JSON line per JVM, rotated once the file reaches FILE_SINK_MAX_BYTES."""
+    try:
+        if os.path.getsize(FILE_SINK_PATH) >= FILE_SINK_MAX_BYTES:
+            os.replace(FILE_SINK_PATH, FILE_SINK_PATH + ".1")
+    except OSError:
+        pass
+    with open(FILE_SINK_PATH, "a") as f:
+        for pid, stats in sample.collected.items():
+            f.write(json.dumps({
+                "time": stats.get("time", int(sample.collected_at * 1e9)),
+                "instance": INSTANCE,
+                "pid": pid,
+                "appname": stats["sysprops"].get("appname", "unknown"),
+                "variant": stats["sysprops"].get("variant", "unknown"),
+                "max_heap_size": stats["heap"].get("max_heap_size", 0),
+                "gc": stats["gc"],
+                "gc_window": stats.get("gc_window"),
+                "derived": stats.get("derived"),
+                "alerts": stats.get("alerts"),
+            }) + "\n")
+
+def instrumented(name, handler):
+    return selfmetrics.timed_sink(name, partial(profiled, handler))
+
+def buildSinks():
+    """One SinkWorker per entry of SINKS."""
+    global _influx_writer, _influx_encoder, _pull_store, _metrics_server
+    sinks = []
+    for name in SINKS:
+        if name == "pushgateway":
+            sinks.append(pipeline.SinkWorker(name, instrumented(name, pushSample), PUSH_QUEUE_SIZE))
+        elif name == "influxdb":
+            _influx_encoder = influxsink.LineEncoder(INSTANCE, gc_row=INFLUXDB_GC_LAYOUT == "row")
+            _influx_writer = influxsink.InfluxWriter(
+                _http, INFLUXDB_URL, INFLUXDB_DATABASE, INFLUXDB_TOKEN,
+                batch_size=INFLUXDB_BATCH_SIZE,
+                flush_interval=INFLUXDB_FLUSH_INTERVAL,
+                max_backlog=INFLUXDB_MAX_BACKLOG,
+                compress=INFLUXDB_GZIP,
+                spool=openSpool(),
+                replay_rate=SPOOL_REPLAY_RATE
+            )
+            sinks.append(pipeline.SinkWorker(name, instrumented(name, writeInfluxSample), INFLUXDB_QUEUE_SIZE))
+        elif name == "prometheus":
+            _pull_store = newStore()
+            _metrics_server = metricstore.start_http_server(_pull_store, METRICS_PORT, METRICS_ADDR,
+                                                             extra=selfmetrics.render)
+            # Scrapes want the latest values only
+            sinks.append(pipeline.SinkWorker(name, instrumented(name, serveSample), 1))
+        elif name == "file":
+            os.makedirs(os.path.dirname(FILE_SINK_PATH) or ".", exist_ok=True)
+            sinks.append(pipeline.SinkWorker(name, instrumented(name, writeFileSample), FILE_QUEUE_SIZE))
+        else:
+            print(f"Unknown sink '{name}', ignoring it")
+    _sinks.extend(sinks)
+    return sinks
+
+# Read when the collector's own metrics are rendered
+_sinks = []
+_scheduler = None
+
+def collectorStats():
+    """Sink queues, scheduler and InfluxDB writer state for the jvm_collector_* families."""
+    depth = GaugeMetricFamily("jvm_collector_sink_queue_depth", "Samples waiting for a sink.", labels=["sink"])
+    dropped = CounterMetricFamily("jvm_collector_sink_dropped", "Samples a sink dropped because it fell behind.", labels=["sink"])
+    for sink in _sinks:
+        stats = sink.stats()
+        depth.add_metric([sink.name], stats["queue_depth"])
+        dropped.add_metric([sink.name], stats["dropped"])
+    yield depth
+    yield dropped
+    if _scheduler is not None:
+        yield CounterMetricFamily("jvm_collector_ticks_skipped", "Collection ticks skipped because a cycle overran.",
+                                  value=_scheduler.skipped)
+        yield CounterMetricFamily("jvm_collector_wakeups", "Out-of-band cycles run for JVM starts and exits.",
+                                  value=_scheduler.woken)
+    if _influx_writer is not None:
+        stats = _influx_writer.stats()
+        yield GaugeMetricFamily("jvm_collector_influxdb_backlog_lines", "Lines waiting to be written to InfluxDB.",
+                                value=stats["backlog_lines"])
+        yield CounterMetricFamily("jvm_collector_influxdb_dropped_lines", "Lines dropped because the backlog was full.",
+                                  value=stats["dropped_lines"])
+        yield CounterMetricFamily("jvm_collector_influxdb_failed_flushes", "InfluxDB writes that failed.",
+                                  value=stats["failed_flushes"])
+
+selfmetrics.register(collectorStats)
+
+def collectTimed():
+    """The collection the pipeline runs each tick, timed (and profiled on demand)."""
+    with selfmetrics.CYCLE_SECONDS.time():
+        return profiled(collectCycleOnLoop if RUNTIME == "asyncio" else collectCycle)
+
+def push_metrics():
+    """One synchronous collect-and-push cycle."""
+    pushCycle(updateStore(collectCycle()))
+
+# asyncio runtime (RUNTIME=asyncio): all PIDs are scheduled from a single
+# event loop, COLLECT_WORKERS at a time. Each one runs the same collectPID() as
+# the thread runtime in a worker thread, so there is one copy of the
+# collection logic and its deadline handling.
+
+_pid_semaphore = None
+
+async def collectPIDAsync(pid: int, cycle_deadline: float):
+    # The PID's deadline starts once it holds a slot, not while it waits for one
+    async with _pid_semaphore:
+        return await asyncio.to_thread(profiled, collectPID, pid, cycle_deadline)
+
+async def collectAllAsync(pids):
+    """asyncio counterpart of collectAll()."""
+    if not pids:
+        return {}
+    cycle_deadline = time.monotonic() + CYCLE_TIMEOUT
+    tasks = {asyncio.ensure_future(collectPIDAsync(pid, cycle_deadline)): pid for pid in pids}
+    done, late = await asyncio.wait(tasks, timeout=CYCLE_TIMEOUT)
+
+    collected = {}
+    for task in done:
+        pid = tasks[task]
+        try:
+            stats = task.result()
+        except subprocess.TimeoutExpired as e:
+            print(f"Skipping PID {pid}: {e.cmd[0]} did not finish in time and was killed")
+            selfmetrics.PIDS_SKIPPED.labels("timeout").inc()
+            continue
+        except Exception as e:
+            print(f"Error collecting metrics for PID {pid}: {e}")
+            selfmetrics.PIDS_SKIPPED.labels("error").inc()
+            continue
+        if stats is not None:
+            collected[pid] = stats
+    for task in late:
+        # Queued ones never start; running ones are killed by their own deadline
+        task.cancel()
+        print(f"Skipping PID {tasks[task]}: not collected within the {CYCLE_TIMEOUT}s cycle deadline")
+        selfmetrics.PIDS_SKIPPED.labels("deadline").inc()
+    await asyncio.gather(*late, return_exceptions=True)
+    return collected
+
+async def collectCycleAsync():
+    with selfmetrics.phase("discover"):
+        current_pids = await asyncio.to_thread(getPIDs)
+    with selfmetrics.phase("prune"):
+        final = finalSamples(current_pids)
+        pruneCaches(current_pids)
+    with selfmetrics.phase("collect"):
+        collected = await collectAllAsync(current_pids)
+    return finishCycle(collected, final, current_pids)
+
+_loop = None
+
+def collectCycleOnLoop():
+    """RUNTIME=asyncio: one collection on a long-lived event loop."""
+    global _loop, _pid_semaphore
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        _pid_semaphore = asyncio.Semaphore(COLLECT_WORKERS)
+    return _loop.run_until_complete(collectCycleAsync())
 
 def handle_shutdown(signum, frame):
     global shutdown_flag
     shutdown_flag = True
+    _stop.set()
+    _wake.set()
     print("Shutdown signal received. Exiting gracefully...")
 
 signal.signal(signal.SIGINT,  handle_shutdown)
@@ -217,21 +1005,71 @@ signal.signal(signal.SIGTERM, handle_shutdown)
 
 if __name__ == '__main__':
     print("Starting Pushgateway metrics pusher...")
-    print(f"Pushgateway URL: {PUSHGATEWAY_URL}, Interval: {PUSH_INTERVAL}s, Job: {JOB_NAME}, Instance: {INSTANCE}")
+    print(f"Pushgateway URL: {PUSHGATEWAY_URL}, Interval: {PUSH_INTERVAL}s, Job: {JOB_NAME}, Instance: {INSTANCE}, GC provider: {GC_PROVIDER}, Runtime: {RUNTIME}, Push mode: {PUSH_MODE}, Watch: {WATCH}, Sinks: {','.join(SINKS)}")
     
-    while not shutdown_flag:
+    # Collection ticks on the wall clock; each sink drains its own bounded
+    # queue on its own thread, so a slow sink never delays sampling
+    loaded = _metadata.load()
+    if loaded:
+        print(f"Loaded cached metadata of {loaded} running JVMs from {METADATA_CACHE}")
+    if PROFILE_DIR:
+        _profiler = selfmetrics.Profiler(PROFILE_DIR)
+    # Both import NumPy, so only when they are on
+    if WINDOW_SAMPLE_MS > 0 and GC_PROVIDER == "hsperfdata":
         try:
-            push_metrics()
-        except KeyboardInterrupt:
-            # Handle keyboard interrupt gracefully
-            shutdown_flag = True
-            break
-        except Exception as e:
-            # Log error but continue running
-            print(f"Unexpected error in push_metrics: {e}")
-            traceback.print_exc()
-        
-        if not shutdown_flag:
-            time.sleep(PUSH_INTERVAL)   
-    
+            import ringbuffer
+            # One interval of samples per JVM; an overrun keeps the newest ones
+            _windows = ringbuffer.RingBuffers(math.ceil(PUSH_INTERVAL * 1000 / WINDOW_SAMPLE_MS))
+            _window_sampler = ringbuffer.Sampler(_windows, WINDOW_SAMPLE_MS / 1000.0)
+        except ImportError as e:
+            print(f"GC windows are off (WINDOW_SAMPLE_MS needs NumPy, see requirements-all-fix.txt): {e}")
+    if OOM_FORECAST_WINDOW > 0:
+        try:
+            import oomforecast
+            # One point per cycle at most, plus room for out-of-band cycles
+            _forecaster = oomforecast.Forecaster(OOM_FORECAST_WINDOW, 2 * math.ceil(OOM_FORECAST_WINDOW / PUSH_INTERVAL),
+                                                 OOM_FORECAST_MIN_POINTS)
+            DERIVED_METRICS.update(oomforecast.METRICS)
+        except ImportError as e:
+            print(f"OOM forecast is off (OOM_FORECAST_WINDOW_SECONDS needs NumPy, see requirements-all-fix.txt): {e}")
+    if ALERT_RULES:
+        _rules = alertrules.RuleSet(alertrules.parse_rules(ALERT_RULES, ALERT_HYSTERESIS), ALERT_MIN_PUSH_INTERVAL)
+        print(f"Alert rules: {', '.join(f'{name}: {rule}' for name, rule in _rules.rules.items()) or 'none'}")
+        if _window_sampler is not None and "pushgateway" in SINKS:
+            _alert_worker = pipeline.SinkWorker("alerts", instrumented("alerts", pushAlert), 100)
+            _sinks.append(_alert_worker)
+            _window_sampler.on_sample = onFreshSample
+    if PUSH_MODE == "pid" and "pushgateway" in SINKS:
+        adoptGroups()
+    sinks = buildSinks()
+    if WATCH == "inotify":
+        # Polling still runs: a JVM killed with SIGKILL never deletes its file
+        _watcher = jvmwatch.Watcher(hsperfdata.HSPERFDATA_TMPDIR, onJVMEvent)
+        if _watcher.start():
+            print(f"Watching {hsperfdata.HSPERFDATA_TMPDIR}/hsperfdata_* for JVM starts and exits")
+        else:
+            _watcher = None
+    _scheduler = pipeline.Scheduler(PUSH_INTERVAL, _stop, _wake)
+    pipeline.run(PUSH_INTERVAL, collectTimed, sinks, _stop, scheduler=_scheduler)
+
+    # Sinks drain concurrently on their own threads; they share one deadline
+    shutdown_deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    if _window_sampler is not None:
+        _window_sampler.on_sample = None
+    for sink in _sinks:
+        sink.stop(max(shutdown_deadline - time.monotonic(), 0))
+    if _influx_writer is not None and not _influx_writer.close(timeout=max(shutdown_deadline - time.monotonic(), 0)):
+        print(f"Dropped {_influx_writer.stats()['backlog_lines']} unwritten lines on shutdown")
+    if _metrics_server is not None:
+        _metrics_server.shutdown()
+    if _watcher is not None:
+        _watcher.close()
+    if _loop is not None:
+        _loop.close()
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _samplers.stop_all()
+    if _window_sampler is not None:
+        _window_sampler.stop()
+    _metadata.save()
+    _http.close()
     print("Shutdown complete.")
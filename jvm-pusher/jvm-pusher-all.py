@@ -6,6 +6,7 @@ import time
 import signal
 from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
 from functools import lru_cache
+import httptransport
 
 # Configuration
 PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "http://pushgateway:9091")
@@ -13,6 +14,9 @@ PUSH_INTERVAL = int(os.getenv("PUSH_INTERVAL_SECONDS", "15"))
 JOB_NAME = os.getenv("JOB_NAME", "jvm_metrics_pusher")
 INSTANCE = os.getenv("INSTANCE", socket.gethostname())
 
+# Pooled keep-alive connections with timeouts, retries and a circuit breaker
+_http = httptransport.Transport.from_env()
+
 shutdown_flag = False
 
 @lru_cache(maxsize=None)
@@ -72,18 +76,26 @@ def getGCData(pid: int):
     except Exception:
         return {}
 
-def push_metrics():
-    registry = CollectorRegistry()
+# Registry and gauges live across cycles; label sets of exited JVMs are removed
+registry = CollectorRegistry()
+
+heap_g = Gauge(
+    "jvm_heap_size_bytes",
+    "Max JVM heap size in bytes",
+    ["pid","appname","variant","instance"],
+    registry=registry
+)
+
+# GC gauges are added as new keys show up
+gc_gauges = {}
 
-    # 1) Heap gauge
-    heap_g = Gauge(
-        "jvm_heap_size_bytes",
-        "Max JVM heap size in bytes",
-        ["pid","appname","variant","instance"],
-        registry=registry
-    )
+# Label values set in the previous cycle, per PID
+_last_labels = {}
 
-    # 2) Collect PIDs + each one's GC data
+def push_metrics():
+    global _last_labels
+
+    # 1) Collect PIDs + each one's GC data
     pids    = getPIDs()
     gc_data = {}
     all_keys = set()
@@ -93,9 +105,8 @@ def push_metrics():
         gc_data[pid] = stats
         all_keys.update(stats.keys())
 
-    # 3) Dynamically register one Gauge per GC key
-    gc_gauges = {}
-    for key in sorted(all_keys):
+    # 2) Dynamically register one Gauge per new GC key
+    for key in sorted(all_keys - gc_gauges.keys()):
         gc_gauges[key] = Gauge(
             f"jvm_gc_{key}_bytes",
             f"JVM GC metric {key}",
@@ -103,7 +114,8 @@ def push_metrics():
             registry=registry
         )
 
-    # 4) Populate gauges
+    # 3) Populate gauges
+    current_labels = {}
     for pid, stats in gc_data.items():
         props = getSysprops(pid)
         labels = {
@@ -112,16 +124,30 @@ def push_metrics():
             "variant":  props.get("variant","unknown"),
             "instance": INSTANCE
         }
+        current_labels[pid] = labels
 
         heap_g.labels(**labels).set(getHeapSize(pid))
 
         for key, g in gc_gauges.items():
             g.labels(**labels).set(stats.get(key, 0.0))
 
+    # 4) Remove series of exited JVMs (or PIDs whose labels changed)
+    for pid, labels in _last_labels.items():
+        if current_labels.get(pid) != labels:
+            heap_g.remove(*labels.values())
+            for g in gc_gauges.values():
+                try:
+                    g.remove(*labels.values())
+                except KeyError:
+                    # Key added after this PID was last set
+                    pass
+    _last_labels = current_labels
+
     # 5) Push
     try:
         push_to_gateway(PUSHGATEWAY_URL, job=JOB_NAME,
-                        registry=registry)
+                        registry=registry,
+                        handler=httptransport.prometheus_handler(_http))
         print(f"Pushed to {PUSHGATEWAY_URL} (job={JOB_NAME})")
     except Exception as e:
         print(f"Push failed: {e}")
@@ -7,6 +7,7 @@ import sys
 import signal
 from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
 from functools import lru_cache
+import httptransport
 
 # Load configurations
 PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "http://pushgateway:9091")
@@ -14,6 +15,9 @@ PUSH_INTERVAL = int(os.getenv("PUSH_INTERVAL_SECONDS", "15"))  # Interval betwee
 JOB_NAME = os.getenv("JOB_NAME", "jvm_metrics_pusher")
 INSTANCE = os.getenv("INSTANCE", socket.gethostname())
 
+# Pooled keep-alive connections with timeouts, retries and a circuit breaker
+_http = httptransport.Transport.from_env()
+
 # GC metrics keys
 GC_METRIC_KEYS = ["s0c", "s1c", "oc", "ec"]
 
@@ -93,24 +97,31 @@ def getPIDs():
         print(f"Error retrieving PIDs: {e}")
     return pids
 
-def push_metrics():
-    registry = CollectorRegistry()
+# Registry and gauges live across cycles; label sets of exited JVMs are removed
+registry = CollectorRegistry()
+
+heap_gauge = Gauge(
+    "jvm_heap_size_bytes",
+    "Max heap size in bytes.",
+    ["pid", "appname", "variant", "instance"],
+    registry=registry
+)
 
-    heap_gauge = Gauge(
-        "jvm_heap_size_bytes",
-        "Max heap size in bytes.",
+gc_gauges = {
+    key: Gauge(
+        f"jvm_gc_{key}_bytes",
+        f"GC metric for {key}.",
         ["pid", "appname", "variant", "instance"],
         registry=registry
-    )
+    ) for key in GC_METRIC_KEYS
+}
 
-    gc_gauges = {
-        key: Gauge(
-            f"jvm_gc_{key}_bytes",
-            f"GC metric for {key}.",
-            ["pid", "appname", "variant", "instance"],
-            registry=registry
-        ) for key in GC_METRIC_KEYS
-    }
+# Label values set in the previous cycle, per PID
+_last_labels = {}
+
+def push_metrics():
+    global _last_labels
+    current_labels = {}
 
     pids = getPIDs()
     for pid in pids:
@@ -121,14 +132,23 @@ def push_metrics():
         appname = sysprops.get("appname", "unknown")
         variant = sysprops.get("variant", "unknown")
         pid_str = str(pid)
+        current_labels[pid] = (pid_str, appname, variant, INSTANCE)
 
         heap_gauge.labels(pid=pid_str, appname=appname, variant=variant, instance=INSTANCE).set(heap.get("max_heap_size", 0))
 
         for key in GC_METRIC_KEYS:
             gc_gauges[key].labels(pid=pid_str, appname=appname, variant=variant, instance=INSTANCE).set(gc_stats.get(key, 0.0))
 
+    for pid, labels in _last_labels.items():
+        if current_labels.get(pid) != labels:
+            heap_gauge.remove(*labels)
+            for gauge in gc_gauges.values():
+                gauge.remove(*labels)
+    _last_labels = current_labels
+
     try:
-        push_to_gateway(PUSHGATEWAY_URL, job=JOB_NAME, registry=registry)
+        push_to_gateway(PUSHGATEWAY_URL, job=JOB_NAME, registry=registry,
+                        handler=httptransport.prometheus_handler(_http))
         print(f"Metrics pushed to {PUSHGATEWAY_URL} for job='{JOB_NAME}'")
     except Exception as e:
         print(f"Failed to push metrics: {e}")
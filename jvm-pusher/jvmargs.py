@@ -0,0 +1,125 @@
+"""
+Resolve JVM options (system properties, -Xmx) of a running JVM from /proc
+without attaching to it.
+
+The options are assembled the way the java launcher and the VM see them:
+JAVA_TOOL_OPTIONS, then JDK_JAVA_OPTIONS, then the command line with @argfiles
+expanded, then _JAVA_OPTIONS. Later occurrences override earlier ones.
+"""
+import os
+import re
+import shlex
+
+import procfs
+
+# Launcher options whose value is the next argument
+_OPTIONS_WITH_VALUE = {
+    "-cp", "-classpath", "--class-path", "-p", "--module-path",
+    "--upgrade-module-path", "--add-modules", "--limit-modules",
+    "--add-reads", "--add-exports", "--add-opens", "--patch-module",
+    "--enable-native-access", "--source",
+}
+
+_SIZE_SUFFIXES = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+_SIZE = re.compile(r"^(\d+)([kmgt]?)$", re.IGNORECASE)
+
+
+def _split_options(value: str):
+    try:
+        return shlex.split(value)
+    except ValueError:
+        return value.split()
+
+
+def _read_argfile(pid: int, path: str):
+    # Relative argfiles are resolved against the JVM's working directory; going
+    # through /proc/<pid>/root also works for JVMs in another mount namespace.
+    if os.path.isabs(path):
+        candidates = [os.path.join(procfs.PROC_ROOT, str(pid), "root", path.lstrip("/")), path]
+    else:
+        candidates = [os.path.join(procfs.PROC_ROOT, str(pid), "cwd", path)]
+    for candidate in candidates:
+        try:
+            with open(candidate, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError:
+            continue
+        try:
+            return shlex.split(text, comments=True)
+        except ValueError:
+            return text.split()
+    return []
+
+
+def _expand_argfiles(pid: int, args):
+    for arg in args:
+        if arg.startswith("@@"):
+            yield arg[1:]
+        elif arg.startswith("@") and len(arg) > 1:
+            yield from _read_argfile(pid, arg[1:])
+        else:
+            yield arg
+
+
+def _launcher_options(pid: int, argv):
+    """JVM options from the launcher command line, up to the main class / -jar / -m."""
+    options = []
+    args = _expand_argfiles(pid, argv[1:])
+    for arg in args:
+        if not arg.startswith("-") or arg in ("-jar", "-m", "--module") or arg.startswith("--module="):
+            break
+        options.append(arg)
+        if arg in _OPTIONS_WITH_VALUE:
+            next(args, None)
+    return options
+
+
+def jvm_options(pid: int):
+    """All JVM options of `pid` in override order, or None if /proc/<pid> is unreadable."""
+    argv = procfs.cmdline(pid)
+    if not argv:
+        return None
+    env = procfs.environ(pid) or {}
+    options = []
+    options.extend(_split_options(env.get("JAVA_TOOL_OPTIONS", "")))
+    options.extend(_split_options(env.get("JDK_JAVA_OPTIONS", "")))
+    options.extend(_launcher_options(pid, argv))
+    options.extend(_split_options(env.get("_JAVA_OPTIONS", "")))
+    return options
+
+
+def split_vm_args(vm_args: str):
+    """
+    Split the space-joined java.rt.vmArgs counter back into options. Values may
+    contain spaces, so only a space followed by '-' starts a new option.
+    """
+    return [option for option in re.split(r" +(?=-)", vm_args.strip()) if option]
+
+
+def system_property(options, name: str):
+    """Value of -D<name>=... (last one wins), or None."""
+    prefix = f"-D{name}="
+    value = None
+    for option in options:
+        if option.startswith(prefix):
+            value = option[len(prefix):]
+    return value
+
+
+def parse_size(value: str):
+    """JVM size argument ("512m", "2G", "1048576") in bytes, or None."""
+    match = _SIZE.match(value.strip())
+    if not match:
+        return None
+    return int(match.group(1)) * _SIZE_SUFFIXES[match.group(2).lower()]
+
+
+def max_heap_size(options):
+    """Max heap size in bytes from -Xmx / -XX:MaxHeapSize (last one wins), or None."""
+    size = None
+    for option in options:
+        if option.startswith("-Xmx"):
+            size = parse_size(option[4:]) or size
+        elif option.startswith("-XX:MaxHeapSize="):
+            size = parse_size(option[len("-XX:MaxHeapSize="):]) or size
+    return size
@@ -0,0 +1,151 @@
+"""
+Event-driven JVM discovery: inotify on the hsperfdata directories.
+
+Every JVM creates <tmpdir>/hsperfdata_<user>/<pid> when it starts and deletes
+it when it exits, so watching those directories reports starts and stops as
+they happen instead of once per poll. A JVM killed with SIGKILL leaves its file
+behind and sends no event; the periodic scan still reconciles those.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+START   = "start"
+STOP    = "stop"
+# Events were lost (kernel queue overflow): only a full scan can tell what changed
+RESCAN  = "rescan"
+
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO   = 0x00000080
+_IN_CREATE     = 0x00000100
+_IN_DELETE     = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED    = 0x00008000
+_IN_ONLYDIR    = 0x01000000
+_IN_ISDIR      = 0x40000000
+_IN_NONBLOCK   = 0o4000
+_IN_CLOEXEC    = 0o2000000
+
+_ROOT_MASK = _IN_CREATE | _IN_MOVED_TO | _IN_ONLYDIR
+_USER_MASK = _IN_CREATE | _IN_MOVED_TO | _IN_DELETE | _IN_MOVED_FROM | _IN_ONLYDIR
+
+# struct inotify_event: wd, mask, cookie, len, then `len` bytes of NUL padded name
+_EVENT = struct.Struct("iIII")
+
+
+class Watcher:
+    """
+    Calls `on_event(event, pid)` from a background thread for every JVM that
+    starts (START) or exits (STOP) under `root`, and `on_event(RESCAN, None)`
+    when the kernel dropped events.
+    """
+
+    def __init__(self, root: str, on_event):
+        self.root = root
+        self.on_event = on_event
+        self._fd = None
+        self._root_wd = None
+        self._dirs = {}                 # watch descriptor -> hsperfdata_<user> path
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self) -> bool:
+        """Start watching; False when inotify is not available (not Linux, no watches left...)."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available: {e}")
+            return False
+        if fd < 0:
+            print(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+            return False
+        self._fd = fd
+        self._root_wd = self._watch(self.root, _ROOT_MASK)
+        if self._root_wd is None:
+            self.close()
+            return False
+        for name in os.listdir(self.root):
+            if name.startswith("hsperfdata_"):
+                self._watch_user(os.path.join(self.root, name), announce=False)
+        self._thread = threading.Thread(target=self._run, name="jvmwatch", daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _watch(self, path: str, mask: int):
+        wd = self._add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            print(f"Cannot watch {path}: {os.strerror(ctypes.get_errno())}")
+            return None
+        return wd
+
+    def _watch_user(self, path: str, announce: bool):
+        wd = self._watch(path, _USER_MASK)
+        if wd is None:
+            return
+        self._dirs[wd] = path
+        if announce:
+            # JVMs that created their file before the watch was in place
+            try:
+                names = os.listdir(path)
+            except OSError:
+                return
+            for name in names:
+                if name.isdigit():
+                    self._emit(START, int(name))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                ready, _, _ = select.select([self._fd], [], [], 0.5)
+                if not ready:
+                    continue
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                print(f"inotify read failed, stopping the watcher: {e}")
+                self._emit(RESCAN, None)
+                return
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += _EVENT.size + length
+                self._handle(wd, mask, name)
+
+    def _handle(self, wd: int, mask: int, name: str):
+        if mask & _IN_Q_OVERFLOW:
+            print("inotify queue overflowed, some JVM events were lost")
+            self._emit(RESCAN, None)
+        elif wd == self._root_wd:
+            if mask & _IN_ISDIR and name.startswith("hsperfdata_"):
+                self._watch_user(os.path.join(self.root, name), announce=True)
+        elif mask & _IN_IGNORED:
+            # The user's directory was removed
+            self._dirs.pop(wd, None)
+        elif wd in self._dirs and name.isdigit():
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._emit(START, int(name))
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                self._emit(STOP, int(name))
+
+    def _emit(self, event: str, pid):
+        try:
+            self.on_event(event, pid)
+        except Exception as e:
+            print(f"JVM {event} handler failed for PID {pid}: {e}")
@@ -0,0 +1,106 @@
+"""
+JVM metadata cache keyed by process identity, persisted across restarts.
+
+Entries (sysprops, heap size, ...) are keyed by (pid, start ticks) from
+/proc/<pid>/stat, so a reused PID never inherits another process's appname.
+The cache is saved as JSON and validated on load: entries whose process is gone
+or was replaced are dropped, and the whole file is ignored after a reboot.
+A restarted pusher therefore does not attach to every JVM again. Only answers
+are cached: a lookup that failed is left out and tried again.
+"""
+import json
+import os
+import threading
+
+import procfs
+
+# 2: no longer holds the fallbacks of failed lookups
+_VERSION = 2
+
+
+class MetadataCache:
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._entries = {}              # (pid, start ticks) -> {kind: value}
+        self._ticks = {}                # pid -> start ticks, memo until the next prune()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _key(self, pid: int):
+        ticks = self._ticks.get(pid)
+        if ticks is None:
+            ticks = self._ticks[pid] = procfs.start_ticks(pid)
+        return pid, ticks
+
+    def get(self, pid: int, kind: str):
+        """Cached `kind` of the process currently running as `pid`, or None."""
+        with self._lock:
+            entry = self._entries.get(self._key(pid))
+            return None if entry is None else entry.get(kind)
+
+    def put(self, pid: int, kind: str, value):
+        with self._lock:
+            self._entries.setdefault(self._key(pid), {})[kind] = value
+            self._dirty = True
+
+    def prune(self, live_pids):
+        """Drop entries of processes that are gone; start ticks are re-read next cycle."""
+        with self._lock:
+            self._ticks = {}
+            for key in [key for key in self._entries if key[0] not in live_pids
+                        or self._key(key[0]) != key]:
+                del self._entries[key]
+                self._dirty = True
+
+    def load(self):
+        """Read the persisted cache, keeping only entries whose process is still the same."""
+        if not self.path:
+            return 0
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"Ignoring metadata cache {self.path}: {e}")
+            return 0
+        if not isinstance(data, dict) or data.get("version") != _VERSION \
+                or data.get("boot_time") != procfs.boot_time():
+            # Other format, or start ticks of another boot
+            return 0
+        loaded = 0
+        with self._lock:
+            for item in data.get("entries", []):
+                try:
+                    pid, ticks, values = int(item["pid"]), int(item["start_ticks"]), dict(item["values"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if self._key(pid) == (pid, ticks):
+                    self._entries[(pid, ticks)] = values
+                    loaded += 1
+        return loaded
+
+    def save(self):
+        """Write the cache if it changed (atomically, via a temporary file)."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [
+                {"pid": pid, "start_ticks": ticks, "values": values}
+                for (pid, ticks), values in self._entries.items()
+                if ticks is not None
+            ]
+            self._dirty = False
+        data = {"version": _VERSION, "boot_time": procfs.boot_time(), "entries": entries}
+        tmp = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Failed to save metadata cache {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
@@ -0,0 +1,195 @@
+"""
+Long-lived metric store that renders the Prometheus text exposition format.
+
+Series are keyed by (metric, pid). The label part of every line is serialized
+once per PID, the value part only when the value changes, and each metric
+family keeps its rendered block until one of its series changes. Rendering a
+cycle where nothing changed returns the previous bytes as they are.
+"""
+import gzip
+import http.server
+import threading
+
+from prometheus_client.utils import floatToGoString
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+class MetricStore:
+    """Gauges for many PIDs sharing one label set layout."""
+
+    def __init__(self, label_names, const_labels=None):
+        # label_names are per PID (e.g. pid/appname/variant), const_labels are
+        # appended to every series (e.g. instance)
+        self.label_names = list(label_names)
+        self._const = "".join(
+            f',{name}="{_escape(str(value))}"' for name, value in (const_labels or {}).items()
+        )
+        self._help = {}                 # metric -> help text
+        self._headers = {}              # metric -> "# HELP ...\n# TYPE ...\n"
+        self._labels = {}               # pid -> (label values, serialized "{...}")
+        self._values = {}               # pid -> {metric: value}
+        self._lines = {}                # (metric, pid) -> rendered line
+        self._blocks = {}               # metric -> rendered family block (cache)
+        self._rendered = None
+        self._lock = threading.Lock()
+
+    def declare(self, metric: str, help_text: str):
+        if metric not in self._help:
+            self._help[metric] = help_text
+            self._headers[metric] = f"# HELP {metric} {help_text}\n# TYPE {metric} gauge\n"
+            self._rendered = None
+
+    def update(self, pid, label_values, values) -> bool:
+        """
+        Set the values ({metric: float}) of one PID. Metrics missing from
+        `values` are removed for that PID. Returns True if anything changed.
+        """
+        label_values = tuple(label_values)
+        changed_metrics = set()
+        with self._lock:
+            labels = self._labels.get(pid)
+            if labels is None or labels[0] != label_values:
+                pairs = ",".join(
+                    f'{name}="{_escape(str(value))}"'
+                    for name, value in zip(self.label_names, label_values)
+                )
+                self._labels[pid] = (label_values, "{" + pairs + self._const + "}")
+                # New labels (PID reuse, renamed app): every line of the PID changes
+                old = self._values.pop(pid, {})
+                for metric in old:
+                    del self._lines[(metric, pid)]
+                changed_metrics.update(old)
+
+            serialized = self._labels[pid][1]
+            current = self._values.setdefault(pid, {})
+            for metric in [m for m in current if m not in values]:
+                del current[metric]
+                del self._lines[(metric, pid)]
+                changed_metrics.add(metric)
+            for metric, value in values.items():
+                if current.get(metric) == value and (metric, pid) in self._lines:
+                    continue
+                current[metric] = value
+                self._lines[(metric, pid)] = f"{metric}{serialized} {floatToGoString(value)}\n"
+                changed_metrics.add(metric)
+
+            self._invalidate(changed_metrics)
+        return bool(changed_metrics)
+
+    def remove(self, pid) -> bool:
+        """Drop every series of `pid`."""
+        with self._lock:
+            values = self._values.pop(pid, None)
+            self._labels.pop(pid, None)
+            if not values:
+                return False
+            for metric in values:
+                del self._lines[(metric, pid)]
+            self._invalidate(values)
+        return True
+
+    def retain(self, pids):
+        """Drop every series of PIDs not in `pids`; returns the removed PIDs."""
+        with self._lock:
+            gone = [pid for pid in self._labels if pid not in pids]
+        for pid in gone:
+            self.remove(pid)
+        return gone
+
+    def values(self, pid):
+        """Copy of the current {metric: value} of `pid`."""
+        with self._lock:
+            return dict(self._values.get(pid, {}))
+
+    def label_values(self, pid):
+        """Label values of `pid` as passed to update(), or None."""
+        with self._lock:
+            labels = self._labels.get(pid)
+            return None if labels is None else labels[0]
+
+    def pids(self):
+        with self._lock:
+            return list(self._labels)
+
+    def _invalidate(self, metrics):
+        for metric in metrics:
+            self._blocks.pop(metric, None)
+        if metrics:
+            self._rendered = None
+
+    def _block(self, metric: str) -> str:
+        block = self._blocks.get(metric)
+        if block is None:
+            lines = [self._lines[(metric, pid)] for pid in self._values
+                     if (metric, pid) in self._lines]
+            block = self._headers[metric] + "".join(lines) if lines else ""
+            self._blocks[metric] = block
+        return block
+
+    def render(self) -> bytes:
+        """The whole store in text exposition format (cached until something changes)."""
+        with self._lock:
+            if self._rendered is None:
+                self._rendered = "".join(self._block(m) for m in self._help).encode()
+            return self._rendered
+
+    def render_pid(self, pid, metrics=None) -> bytes:
+        """Only the series of `pid` (optionally only `metrics`), in text exposition format."""
+        with self._lock:
+            values = self._values.get(pid, {})
+            return "".join(
+                self._headers[metric] + self._lines[(metric, pid)]
+                for metric in self._help
+                if metric in values and (metrics is None or metric in metrics)
+            ).encode()
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    store = None
+    extra = None
+    _gzipped = (None, b"")              # (store's rendered bytes, their gzip), per server
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.store.render()
+        extra = self.extra() if self.extra is not None else b""
+        headers = {"Content-Type": CONTENT_TYPE, "Vary": "Accept-Encoding"}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            cached = type(self)._gzipped
+            if cached[0] is not body:
+                # render() returns the same object until something changes
+                cached = type(self)._gzipped = (body, gzip.compress(body, compresslevel=5))
+            # extra changes on every scrape: compressed on its own, as a second gzip member
+            body = cached[1] + (gzip.compress(extra, compresslevel=5) if extra else b"")
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body += extra
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(store: MetricStore, port: int, addr: str = "", extra=None):
+    """
+    Serve `store` at /metrics for Prometheus to scrape, followed by the bytes
+    `extra()` returns if given; returns the server (shutdown() stops it).
+    """
+    handler = type("StoreHandler", (_Handler,), {"store": store, "extra": staticmethod(extra) if extra else None})
+    server = http.server.ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,143 @@
+"""
+Old generation time-to-exhaustion forecast per JVM.
+
+Every sample taken after at least one collection since the previous one adds
+a (time, OU) point to the JVM's sliding window; OU only moves at collections,
+so those points trace post-GC occupancy. At forecast time a least-squares
+line is fitted through the windows of all JVMs at once (NumPy, one row per
+JVM) and extrapolated to the old generation's limit: what predict_linear()
+would compute, without a range query per series.
+"""
+import numpy as np
+
+import procfs
+
+METRICS = {
+    "gc_old_seconds_to_exhaustion": "Seconds until old generation occupancy reaches its limit at the current post-GC trend (only while growing).",
+    "gc_old_leak_suspect":          "1 when post-GC old generation occupancy grows steadily and its floor keeps rising, else 0.",
+}
+
+# How well the line must fit (r squared) before growth counts as a leak
+_LEAK_MIN_R2 = 0.8
+
+
+class Forecaster:
+    def __init__(self, window: float, capacity: int, min_points: int = 6, slots: int = 64):
+        self.window = window            # seconds of points used by forecast()
+        self.min_points = min_points
+        self._time = np.full((slots, capacity), np.nan)
+        self._used = np.full((slots, capacity), np.nan)  # OU in KB
+        self._next = np.zeros(slots, dtype=np.int64)
+        self._slots = {}                # pid -> slot
+        self._last = {}                 # pid -> (start ticks, collections)
+        self._free = list(range(slots - 1, -1, -1))
+
+    def observe(self, pid: int, time_ns: int, gc: dict):
+        """Record the sample's OU if the JVM collected since the previous one."""
+        if "ou" not in gc:
+            return
+        ticks = procfs.start_ticks(pid)
+        collections = gc.get("ygc", 0) + gc.get("fgc", 0) + gc.get("cgc", 0)
+        last = self._last.get(pid)
+        self._last[pid] = (ticks, collections)
+        if last is not None and last[0] != ticks:
+            # Another process behind the PID: its points say nothing about this one
+            self._release(pid)
+            return
+        if last is None or collections <= last[1]:
+            return
+        slot = self._slots.get(pid)
+        if slot is None:
+            slot = self._slots[pid] = self._allocate()
+        column = self._next[slot] % self._time.shape[1]
+        self._time[slot, column] = time_ns / 1e9
+        self._used[slot, column] = gc["ou"]
+        self._next[slot] += 1
+
+    def retain(self, pids):
+        """Forget the windows of PIDs not in `pids`."""
+        for pid in [pid for pid in self._last if pid not in pids]:
+            del self._last[pid]
+            self._release(pid)
+
+    def forecast(self, limits, now: float):
+        """
+        {pid: {"gc_old_seconds_to_exhaustion": s, "gc_old_leak_suspect": 0/1}}
+        for the PIDs in `limits` ({pid: old generation limit in KB}) that
+        have at least min_points in the window. Seconds are left out while
+        occupancy is not growing.
+        """
+        pids = [pid for pid in limits if pid in self._slots]
+        if not pids:
+            return {}
+        slots = np.array([self._slots[pid] for pid in pids])
+        t = self._time[slots] - now     # seconds, <= 0
+        y = self._used[slots]
+        valid = ~np.isnan(t) & (t >= -self.window)
+        t = np.where(valid, t, 0.0)
+        n = valid.sum(axis=1)
+        # Centred on each row's mean, so sums of squares of large KB values keep their precision
+        count = np.maximum(n, 1)
+        mean_y = np.where(valid, y, 0.0).sum(axis=1) / count
+        y = np.where(valid, y - mean_y[:, None], 0.0)
+        st, sy = t.sum(axis=1), y.sum(axis=1)
+        stt, sty, syy = (t * t).sum(axis=1), (t * y).sum(axis=1), (y * y).sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            den_t = n * stt - st * st
+            cov = n * sty - st * sy
+            slope = cov / den_t                         # KB per second
+            level = mean_y + (sy - slope * st) / count  # fitted OU now
+            r2 = cov * cov / (den_t * (n * syy - sy * sy))
+            limit = np.array([limits[pid] for pid in pids], dtype=float)
+            seconds = np.where(level >= limit, 0.0, (limit - level) / slope)
+
+            # The floor (lowest post-GC value) of the newer half above that of the older half
+            oldest = np.where(valid, t, np.inf).min(axis=1)
+            newer = valid & (t >= oldest[:, None] / 2)
+            older = valid & ~newer
+            floor_newer = np.where(newer, y, np.inf).min(axis=1)
+            floor_older = np.where(older, y, np.inf).min(axis=1)
+
+        enough = (n >= self.min_points) & (den_t > 0)
+        growing = enough & ((slope > 0) | (level >= limit)) & np.isfinite(seconds)
+        leak = growing & (r2 >= _LEAK_MIN_R2) & (floor_newer > floor_older)
+
+        forecasts = {}
+        for i, pid in enumerate(pids):
+            if not enough[i]:
+                continue
+            forecast = {"gc_old_leak_suspect": 1 if leak[i] else 0}
+            if growing[i]:
+                forecast["gc_old_seconds_to_exhaustion"] = round(float(seconds[i]), 1)
+            forecasts[pid] = forecast
+        return forecasts
+
+    def _allocate(self) -> int:
+        if not self._free:
+            slots, capacity = self._time.shape
+            self._time = np.vstack([self._time, np.full((slots, capacity), np.nan)])
+            self._used = np.vstack([self._used, np.full((slots, capacity), np.nan)])
+            self._next = np.concatenate([self._next, np.zeros(slots, dtype=np.int64)])
+            self._free = list(range(slots * 2 - 1, slots - 1, -1))
+        return self._free.pop()
+
+    def _release(self, pid: int):
+        slot = self._slots.pop(pid, None)
+        if slot is not None:
+            self._time[slot] = np.nan
+            self._used[slot] = np.nan
+            self._next[slot] = 0
+            self._free.append(slot)
+
+
+def old_gen_limit(max_heap_size, gc: dict):
+    """
+    KB the old generation can grow to: the max heap (bytes, 0 if unknown)
+    minus the current young generation, never less than OC.
+    """
+    oc = gc.get("oc", 0.0)
+    if not max_heap_size:
+        return oc
+    young = gc.get("ec", 0.0) + gc.get("s0c", 0.0) + gc.get("s1c", 0.0)
+    return max(max_heap_size / 1024.0 - young, oc)
@@ -0,0 +1,174 @@
+"""
+Collect -> queue -> sink pipeline.
+
+A scheduler ticks on fixed wall-clock boundaries and runs the collector once
+per tick, plus once more whenever something sets its wake event (a JVM
+started or exited). Each sample is offered to every sink's own bounded queue, which drops
+its oldest sample when full, and every sink drains its queue on its own thread.
+A slow or stuck sink therefore only fills its own queue; it never delays
+sampling or the other sinks.
+"""
+import collections
+import threading
+import time
+import traceback
+
+
+class Sample:
+    """One collection: {pid: stats} plus when (epoch seconds) and how long it took."""
+
+    __slots__ = ("collected", "collected_at", "duration")
+
+    def __init__(self, collected, collected_at: float, duration: float):
+        self.collected = collected
+        self.collected_at = collected_at
+        self.duration = duration
+
+
+def next_tick(interval: float, now: float) -> float:
+    """The first multiple of `interval` (epoch seconds) after `now`."""
+    return (now // interval + 1) * interval
+
+
+class Scheduler:
+    """
+    Yields tick times aligned to multiples of `interval` on the wall clock, so
+    the period does not drift by however long a cycle took. A cycle that
+    overruns makes the scheduler skip the ticks it missed rather than bunch up.
+
+    Setting `wake` yields an extra, out-of-band time right away without moving
+    the regular ticks. Whoever sets `stop` must then set `wake` too.
+    """
+
+    def __init__(self, interval: float, stop: threading.Event, wake: threading.Event = None):
+        self.interval = interval
+        self.stop = stop
+        self.wake = wake
+        self.skipped = 0
+        self.woken = 0
+
+    def __iter__(self):
+        tick = next_tick(self.interval, time.time())
+        while not self.stop.is_set():
+            delay = tick - time.time()
+            if delay > 0:
+                if self.wake is None:
+                    if self.stop.wait(delay):
+                        return
+                elif self.wake.wait(delay):
+                    if self.stop.is_set():
+                        return
+                    self.wake.clear()
+                    self.woken += 1
+                    yield time.time()
+                    continue
+            yield tick
+            now = time.time()
+            following = next_tick(self.interval, now)
+            missed = int((following - tick) / self.interval) - 1
+            if missed > 0:
+                self.skipped += missed
+                print(f"Collection overran its interval, skipped {missed} tick(s)")
+            tick = following
+
+
+class DropOldestQueue:
+    """Bounded queue whose put() never blocks: when full, the oldest item is dropped."""
+
+    def __init__(self, maxsize: int):
+        self._items = collections.deque(maxlen=max(maxsize, 1))
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item) -> bool:
+        """Returns True if an older item had to be dropped."""
+        with self._cond:
+            dropped = len(self._items) == self._items.maxlen
+            if dropped:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        """The oldest item, or None if nothing arrived within `timeout`."""
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class SinkWorker:
+    """Runs `handler(sample)` for the samples of one sink on a dedicated thread."""
+
+    def __init__(self, name: str, handler, queue_size: int = 1):
+        self.name = name
+        self.handler = handler
+        self.queue = DropOldestQueue(queue_size)
+        self.handled = 0
+        self.failed = 0
+        self.last_seconds = 0.0
+        self._busy = False
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sink-{name}", daemon=True)
+        self._thread.start()
+
+    def offer(self, sample: Sample):
+        if self.queue.put(sample):
+            print(f"Sink {self.name} is behind, dropped its oldest queued sample")
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self.queue),
+            "dropped": self.queue.dropped,
+            "handled": self.handled,
+            "failed": self.failed,
+            "last_seconds": self.last_seconds,
+        }
+
+    def stop(self, timeout: float):
+        """Give the sink up to `timeout` seconds to drain its queue, then stop it."""
+        deadline = time.monotonic() + timeout
+        while (len(self.queue) or self._busy) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        self._thread.join(max(deadline - time.monotonic(), 0) + 1.0)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            sample = self.queue.get(timeout=0.5)
+            if sample is None:
+                continue
+            self._busy = True
+            started = time.monotonic()
+            try:
+                self.handler(sample)
+                self.handled += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Sink {self.name} failed: {e}")
+                traceback.print_exc()
+            self.last_seconds = time.monotonic() - started
+            self._busy = False
+
+
+def run(interval: float, collect, sinks, stop: threading.Event, wake: threading.Event = None, scheduler=None):
+    """
+    Collect on every tick and fan each sample out to all sinks until `stop` is
+    set. Pass a `scheduler` to read its counters while this runs.
+    """
+    for tick in scheduler or Scheduler(interval, stop, wake):
+        started = time.monotonic()
+        try:
+            collected = collect()
+        except Exception as e:
+            print(f"Unexpected error in collection: {e}")
+            traceback.print_exc()
+            continue
+        sample = Sample(collected, tick, time.monotonic() - started)
+        for sink in sinks:
+            sink.offer(sample)
@@ -0,0 +1,98 @@
+"""
+Small helpers for reading process information from /proc (Linux only).
+"""
+import os
+
+PROC_ROOT = os.getenv("PROC_ROOT", "/proc")
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_boot_time = None
+
+
+def boot_time() -> float:
+    """Seconds since the epoch at which the host booted (btime in /proc/stat)."""
+    global _boot_time
+    if _boot_time is None:
+        _boot_time = 0.0
+        try:
+            with open(os.path.join(PROC_ROOT, "stat"), "rb") as f:
+                for line in f:
+                    if line.startswith(b"btime "):
+                        _boot_time = float(line.split()[1])
+                        break
+        except OSError:
+            pass
+    return _boot_time
+
+
+def start_ticks(pid: int):
+    """
+    Start time of `pid` in clock ticks since boot (field 22 of /proc/<pid>/stat),
+    or None if the process does not exist. Together with the PID this uniquely
+    identifies a process across PID reuse.
+    """
+    try:
+        with open(os.path.join(PROC_ROOT, str(pid), "stat"), "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces and parentheses, so split after the last ')'
+    fields = stat[stat.rfind(b")") + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def parent_pid(pid: int):
+    """Parent PID of `pid` (field 4 of /proc/<pid>/stat), or None."""
+    try:
+        with open(os.path.join(PROC_ROOT, str(pid), "stat"), "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    try:
+        return int(stat[stat.rfind(b")") + 2:].split()[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def start_time(pid: int):
+    """Start time of `pid` in seconds since the epoch, or None."""
+    ticks = start_ticks(pid)
+    if ticks is None:
+        return None
+    return boot_time() + ticks / _CLK_TCK
+
+
+def cmdline(pid: int):
+    """Argument vector of `pid` from /proc/<pid>/cmdline, or None."""
+    try:
+        with open(os.path.join(PROC_ROOT, str(pid), "cmdline"), "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    return [arg.decode("utf-8", "replace") for arg in raw.split(b"\0")[:-1]]
+
+
+def environ(pid: int):
+    """Environment of `pid` from /proc/<pid>/environ (needs the same uid or root), or None."""
+    try:
+        with open(os.path.join(PROC_ROOT, str(pid), "environ"), "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    env = {}
+    for entry in raw.split(b"\0"):
+        key, sep, value = entry.partition(b"=")
+        if sep:
+            env[key.decode("utf-8", "replace")] = value.decode("utf-8", "replace")
+    return env
+
+
+def cwd(pid: int):
+    """Working directory of `pid` as seen from this mount namespace, or None."""
+    try:
+        return os.readlink(os.path.join(PROC_ROOT, str(pid), "cwd"))
+    except OSError:
+        return None
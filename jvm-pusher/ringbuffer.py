@@ -0,0 +1,197 @@
+"""
+High-frequency GC samples between pushes, kept in fixed-size ring buffers.
+
+A sampler thread reads every JVM's hsperfdata counters several times per push
+interval into one preallocated (JVMs x samples x columns) array, so memory per
+JVM is constant however long it runs. At push time the window of every JVM is
+reduced to min/max/mean/p95 per column in a handful of vectorized NumPy calls
+and the buffers start over, so short spikes in e.g. EU/OU show up even though
+only one point per interval is pushed.
+"""
+import math
+import struct
+import threading
+import time
+import warnings
+
+import numpy as np
+
+import hsperfdata
+
+# The `jstat -gc` columns hsperfdata.gc_columns() produces
+COLUMNS = ("s0c", "s1c", "s0u", "s1u", "ec", "eu", "oc", "ou", "mc", "mu",
+           "ccsc", "ccsu", "ygc", "ygct", "fgc", "fgct", "cgc", "cgct", "gct")
+STATS = ("min", "max", "mean", "p95")
+
+
+class RingBuffers:
+    """Per-PID windows of `capacity` rows of COLUMNS; a full window overwrites its oldest row."""
+
+    def __init__(self, capacity: int, slots: int = 64):
+        self.capacity = capacity
+        self._data = np.full((slots, capacity, len(COLUMNS)), np.nan)
+        self._count = np.zeros(slots, dtype=np.int64)  # rows written since the last drain
+        self._slots = {}                # pid -> slot
+        self._free = list(range(slots - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def append(self, pid: int, gc: dict):
+        row = [gc.get(column, math.nan) for column in COLUMNS]
+        with self._lock:
+            slot = self._slots.get(pid)
+            if slot is None:
+                slot = self._slots[pid] = self._allocate()
+            self._data[slot, self._count[slot] % self.capacity] = row
+            self._count[slot] += 1
+
+    def retain(self, pids):
+        """Free the slots of PIDs not in `pids`."""
+        with self._lock:
+            for pid in [pid for pid in self._slots if pid not in pids]:
+                slot = self._slots.pop(pid)
+                self._data[slot] = np.nan
+                self._count[slot] = 0
+                self._free.append(slot)
+
+    def drain(self):
+        """
+        {pid: {"samples": n, "min": {column: value}, "max": ..., "mean": ..., "p95": ...}}
+        over each PID's rows since the last drain, which are then discarded.
+        Columns a JVM does not have are left out.
+        """
+        with self._lock:
+            pids = [pid for pid, slot in self._slots.items() if self._count[slot]]
+            if not pids:
+                return {}
+            slots = np.array([self._slots[pid] for pid in pids])
+            window = self._data[slots]          # fancy indexing copies
+            counts = np.minimum(self._count[slots], self.capacity)
+            self._data[slots] = np.nan
+            self._count[slots] = 0
+
+        with warnings.catch_warnings():
+            # All-NaN columns (e.g. cgc on a non-concurrent collector) stay NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            reduced = {
+                "min": np.nanmin(window, axis=1),
+                "max": np.nanmax(window, axis=1),
+                "mean": np.nanmean(window, axis=1),
+                "p95": _percentile(window, 0.95),
+            }
+        present = (~np.isnan(reduced["min"])).tolist()
+        rows = {stat: np.round(reduced[stat], 3).tolist() for stat in STATS}
+        counts = counts.tolist()
+        windows = {}
+        for i, pid in enumerate(pids):
+            columns = [(j, column) for j, column in enumerate(COLUMNS) if present[i][j]]
+            result = {"samples": counts[i]}
+            for stat in STATS:
+                values = rows[stat][i]
+                result[stat] = {column: values[j] for j, column in columns}
+            windows[pid] = result
+        return windows
+
+    def _allocate(self) -> int:
+        if not self._free:
+            # Double the slots; existing rows keep their slot numbers
+            slots = len(self._data)
+            grown = np.full((slots * 2, self.capacity, len(COLUMNS)), np.nan)
+            grown[:slots] = self._data
+            self._data = grown
+            self._count = np.concatenate([self._count, np.zeros(slots, dtype=np.int64)])
+            self._free = list(range(slots * 2 - 1, slots - 1, -1))
+        return self._free.pop()
+
+
+def _percentile(window, q: float):
+    """
+    Linear-interpolated quantile along axis 1, ignoring NaN: one sort (NaN
+    sorts last) and a gather, much cheaper than np.nanpercentile.
+    """
+    ordered = np.sort(window, axis=1)
+    valid = np.count_nonzero(~np.isnan(window), axis=1)
+    position = np.maximum(valid - 1, 0) * q
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(valid - 1, 0))
+    low = np.take_along_axis(ordered, lower[:, None, :], axis=1)[:, 0, :]
+    high = np.take_along_axis(ordered, upper[:, None, :], axis=1)[:, 0, :]
+    return np.where(valid > 0, low + (high - low) * (position - lower), np.nan)
+
+
+class Sampler:
+    """
+    Reads the GC columns of the JVMs given to sync() every `interval`
+    seconds into `buffers`, and hands each sample to `on_sample(pid, gc,
+    time_ns)` if set. It maps their hsperfdata files itself, so the
+    collector's own mappings (and their pruning) are never shared between
+    threads.
+    """
+
+    def __init__(self, buffers: RingBuffers, interval: float, on_sample=None):
+        self.buffers = buffers
+        self.interval = interval
+        self.on_sample = on_sample
+        self._perfdata = {}             # pid -> PerfData
+        self._pids = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ring-sampler", daemon=True)
+        self._thread.start()
+
+    def sync(self, live_pids):
+        with self._lock:
+            self._pids = set(live_pids)
+        self.buffers.retain(self._pids)
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join(2.0)
+        for perfdata in self._perfdata.values():
+            perfdata.close()
+        self._perfdata = {}
+
+    def _open(self, pid: int):
+        path = hsperfdata.find_perfdata_file(pid)
+        if path is None:
+            return None
+        try:
+            return hsperfdata.PerfData(path)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self):
+        next_at = time.monotonic()
+        while not self._stopping.is_set():
+            with self._lock:
+                pids = self._pids
+            for pid in [pid for pid in self._perfdata if pid not in pids]:
+                self._perfdata.pop(pid).close()
+            for pid in pids:
+                perfdata = self._perfdata.get(pid)
+                if perfdata is None:
+                    perfdata = self._open(pid)
+                    if perfdata is None:
+                        continue
+                    self._perfdata[pid] = perfdata
+                if not perfdata.accessible:
+                    continue
+                try:
+                    perfdata.refresh()
+                    gc = hsperfdata.gc_columns(perfdata)
+                except (ValueError, struct.error) as e:
+                    print(f"Ring sampler failed to read PID {pid}: {e}")
+                    self._perfdata.pop(pid).close()
+                    continue
+                self.buffers.append(pid, gc)
+                if self.on_sample is not None:
+                    try:
+                        self.on_sample(pid, gc, time.time_ns())
+                    except Exception as e:
+                        print(f"Ring sampler callback failed for PID {pid}: {e}")
+            next_at += self.interval
+            delay = next_at - time.monotonic()
+            if delay < 0:
+                # Reading took longer than the interval: skip rather than bunch up
+                next_at = time.monotonic()
+                delay = 0
+            self._stopping.wait(delay)
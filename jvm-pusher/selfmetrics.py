@@ -0,0 +1,183 @@
+"""
+Self-instrumentation of the collectors.
+
+How long cycles, their phases, every JDK tool run and every sink take, and
+what was skipped or failed, as jvm_collector_* metric families next to the JVM
+metrics. For hot spots that need more than that, Profiler takes a cProfile
+and/or tracemalloc dump on a signal and costs nothing while it is off.
+"""
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import signal
+import subprocess
+import threading
+import time
+import tracemalloc
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+
+REGISTRY = CollectorRegistry(auto_describe=False)
+
+# Tool runs take milliseconds (hsperfdata, warm caches) up to the PID deadline
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CYCLE_SECONDS = Histogram(
+    "jvm_collector_cycle_seconds", "Duration of one collection of all JVMs.",
+    buckets=_BUCKETS, registry=REGISTRY)
+PHASE_SECONDS = Histogram(
+    "jvm_collector_phase_seconds", "Duration of one phase of a cycle (discover, collect, store, push...).",
+    ["phase"], buckets=_BUCKETS, registry=REGISTRY)
+TOOL_SECONDS = Histogram(
+    "jvm_collector_tool_seconds", "Duration of one JDK tool run.",
+    ["tool"], buckets=_BUCKETS, registry=REGISTRY)
+TOOL_RUNS = Counter(
+    "jvm_collector_tool_runs", "JDK tool runs by exit status (ok, error, timeout, missing).",
+    ["tool", "status"], registry=REGISTRY)
+PIDS_SKIPPED = Counter(
+    "jvm_collector_pids_skipped", "JVMs left out of a cycle (unknown appname/variant, timeout, error, deadline).",
+    ["reason"], registry=REGISTRY)
+SINK_SECONDS = Histogram(
+    "jvm_collector_sink_seconds", "Time a sink took for one sample.",
+    ["sink"], buckets=_BUCKETS, registry=REGISTRY)
+SINK_ERRORS = Counter(
+    "jvm_collector_sink_errors", "Samples a sink failed to deliver.",
+    ["sink"], registry=REGISTRY)
+
+
+def phase(name: str):
+    """`with phase("discover"): ...` times one phase of a cycle."""
+    return PHASE_SECONDS.labels(name).time()
+
+
+@contextlib.contextmanager
+def tool_run(tool: str):
+    """Times the tool run inside the block and counts it by how it ended."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    except subprocess.TimeoutExpired:
+        status = "timeout"
+        raise
+    except FileNotFoundError:
+        status = "missing"
+        raise
+    finally:
+        TOOL_SECONDS.labels(tool).observe(time.perf_counter() - started)
+        TOOL_RUNS.labels(tool, status).inc()
+
+
+def timed_sink(name: str, handler):
+    """Wrap a sink handler so its duration and raised errors are recorded."""
+    def handle(sample):
+        started = time.perf_counter()
+        try:
+            return handler(sample)
+        except Exception:
+            SINK_ERRORS.labels(name).inc()
+            raise
+        finally:
+            SINK_SECONDS.labels(name).observe(time.perf_counter() - started)
+    return handle
+
+
+class _Callback:
+    def __init__(self, collect):
+        self.collect = collect
+
+
+def register(collect):
+    """Add metric families computed at render time: `collect()` yields them (queue depths...)."""
+    REGISTRY.register(_Callback(collect))
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+class Profiler:
+    """
+    The first `cpu_signal` starts cProfile, the next one writes the profile to
+    `directory` (a .pstats file, top functions printed) and stops it;
+    `memory_signal` does the same with tracemalloc.
+
+    Code that should show up runs through call(), on whichever thread: each
+    call gets its own profile and the dump merges them. Off, call() is a
+    plain call. Profiles never nest: up to Python 3.11 cProfile only sees
+    the thread that enabled it, so a call inside another one on the same
+    thread is already covered; from 3.12 it sits on sys.monitoring, one
+    profiler for the whole process, and a call made while any profile is
+    running is covered by that one.
+    """
+
+    def __init__(self, directory: str, cpu_signal=signal.SIGUSR1, memory_signal=signal.SIGUSR2):
+        self.directory = directory
+        self.active = False
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        signal.signal(cpu_signal, self._toggle_cpu)
+        signal.signal(memory_signal, self._toggle_memory)
+
+    def call(self, fn, *args):
+        if not self.active or getattr(self._local, "profiling", False):
+            return fn(*args)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python >= 3.12: another thread's profile is running and sees this call
+            return fn(*args)
+        self._local.profiling = True
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+            self._local.profiling = False
+            with self._lock:
+                self._profiles.append(profile)
+
+    def _path(self, kind: str):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+    def _toggle_cpu(self, signum, frame):
+        if not self.active:
+            self.active = True
+            print(f"CPU profiling started, send signal {signum} again to dump it")
+            return
+        self.active = False
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            print("CPU profiling stopped, nothing was profiled")
+            return
+        try:
+            path = self._path("cpu") + ".pstats"
+            out = io.StringIO()
+            stats = pstats.Stats(*profiles, stream=out)
+            stats.dump_stats(path)
+            stats.sort_stats("cumulative").print_stats(25)
+            print(f"CPU profile of {len(profiles)} calls written to {path}\n{out.getvalue()}")
+        except Exception as e:
+            print(f"Failed to write CPU profile: {e}")
+
+    def _toggle_memory(self, signum, frame):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            print(f"Memory tracing started, send signal {signum} again to dump it")
+            return
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            path = self._path("memory") + ".tracemalloc"
+            snapshot.dump(path)
+            top = "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:25])
+            print(f"Memory snapshot written to {path}, top allocations:\n{top}")
+        except Exception as e:
+            print(f"Failed to write memory snapshot: {e}")
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,33 @@
+"""
+The shared modules other images ship next to their script are copies of the
+ones here (each image is built from its own directory). This fails as soon as
+a copy differs; after changing a module, copy it over.
+
+Run from this directory: python -m unittest test_copies
+"""
+import os
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Directory (next to this one) -> modules it ships a copy of
+COPIES = {
+    "jvm-metrics":         ("httptransport.py", "selfmetrics.py"),
+    "jvm-pusher-influxdb": ("httptransport.py", "influxsink.py", "spool.py"),
+}
+
+
+class CopiesTest(unittest.TestCase):
+    def test_copies_match(self):
+        for directory, modules in COPIES.items():
+            for module in modules:
+                with self.subTest(copy=f"{directory}/{module}"):
+                    with open(os.path.join(HERE, module), "rb") as f:
+                        source = f.read()
+                    with open(os.path.join(HERE, os.pardir, directory, module), "rb") as f:
+                        copy = f.read()
+                    self.assertTrue(copy == source, f"{directory}/{module} differs from jvm-pusher/{module}")
+
+
+if __name__ == "__main__":
+    unittest.main()
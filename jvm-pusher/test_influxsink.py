@@ -0,0 +1,87 @@
+"""
+InfluxWriter against a fake transport: what a failed write does to the spool.
+
+Run from this directory: python -m unittest test_influxsink
+"""
+import gzip
+import tempfile
+import threading
+import time
+import unittest
+
+import httptransport
+import influxsink
+import spool
+
+
+class FakeTransport:
+    """Answers every request with `status` (an HTTPError from 400 up) and records it."""
+
+    def __init__(self, status):
+        self.status = status
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, body=None, headers=None, json=None, compress=False):
+        with self.lock:
+            self.requests.append(body)
+        if self.status >= 400:
+            raise httptransport.HTTPError(method, url, self.status, "Fake", b"")
+        return httptransport.Response(self.status, "OK", {}, b"")
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = spool.Spool(self.directory.name)
+        # Two batches as a previous run left them: the first one InfluxDB will never take
+        self.spool.append(gzip.compress(b"bad line\nbad line"))
+        self.spool.append(gzip.compress(b"jvm_gc,pid=1 ou=1.0 1"))
+
+    def tearDown(self):
+        self.writer.close(1.0)
+        self.directory.cleanup()
+
+    def replay(self, status):
+        self.transport = FakeTransport(status)
+        self.writer = influxsink.InfluxWriter(self.transport, "influxdb:8181", "jvm", flush_interval=0.05,
+                                              spool=self.spool)
+
+    def test_rejected_batch_is_dropped(self):
+        self.replay(400)
+        self.assertTrue(wait_for(lambda: self.spool.pending_bytes == 0))
+        self.assertEqual(len(self.transport.requests), 2)
+        self.assertEqual(self.writer.stats()["dropped_lines"], 3)
+        self.assertEqual(self.writer.replayed_batches, 0)
+
+    def test_unavailable_keeps_batch(self):
+        self.replay(503)
+        self.assertTrue(wait_for(lambda: len(self.transport.requests) >= 2))
+        self.assertEqual(set(self.transport.requests), {gzip.compress(b"bad line\nbad line")})
+        self.assertGreater(self.spool.pending_bytes, 0)
+        self.assertEqual(self.writer.stats()["dropped_lines"], 0)
+
+
+class WriteTest(unittest.TestCase):
+    def test_rejected_batch_is_not_spooled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            transport = FakeTransport(400)
+            writer = influxsink.InfluxWriter(transport, "http://influxdb:8181", "jvm", spool=spool.Spool(directory))
+            writer.write(["bad line"])
+            writer.flush(5.0)
+            self.assertEqual(writer.stats()["dropped_lines"], 1)
+            self.assertEqual(writer.spooled_batches, 0)
+            writer.close(1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()